@@ -0,0 +1,163 @@
+"""
+Measures the disk footprint and the read latency of the block store with every
+segment codec. A synthetic chain is written to a temporary store once per codec,
+then read back with cold caches (one read per segment, every read decompresses
+its segment) and with warm caches (random reads through the segment cache). The
+files are not evicted from the page cache, so the cold reads do not include the
+disk latency.
+
+    python benchmark_store.py --blocks 200 --transactions 25
+"""
+
+import argparse
+import os
+import random
+import time
+from tempfile import TemporaryDirectory
+
+from block import NULL_HASH, Block
+from difficulty import MAX_BITS
+from store import CODECS, SEGMENT_CACHE_SIZE, BlockStore
+from transaction import Transaction, now
+from wallet import Wallet
+
+
+def generate_blocks(count: int, transactions: int, wallets: int) -> list[Block]:
+    """
+    Create a chain of signed transactions between a few wallets
+
+    Parameters
+    ----------
+    count : int
+        The number of blocks
+    transactions : int
+        The number of transactions of every block
+    wallets : int
+        The number of wallets sending and receiving, addresses repeat like on a
+        real chain
+
+    Returns
+    -------
+    list[Block]
+        The blocks, without proof of work
+    """
+    keys = [Wallet.generate() for _ in range(wallets)]
+    blocks = []
+    previous = NULL_HASH
+    for height in range(count):
+        block_transactions = []
+        for _ in range(transactions):
+            sender, recipient = random.sample(keys, 2)
+            transaction = Transaction()
+            transaction.sender = sender.public_key
+            transaction.recipient = recipient.public_key
+            transaction.amount = random.randint(1, 1000)
+            transaction.timestamp = now()
+            transaction.sign(sender.private_key)
+            block_transactions.append(transaction)
+        block = Block.create(
+            previous, keys[0].public_key, MAX_BITS, height, block_transactions
+        )
+        block.hash_block()
+        previous = block.hash
+        blocks.append(block)
+    return blocks
+
+
+def segments_size(directory: str) -> int:
+    """Returns the total size of the segment files of a store."""
+    return sum(
+        os.path.getsize(os.path.join(directory, name))
+        for name in os.listdir(directory)
+        if name.startswith("blk")
+    )
+
+
+def measure(blocks: list[Block], codec: str, segment_size: int, reads: int) -> dict:
+    """
+    Write the blocks to a store with a codec and time the reads
+
+    Parameters
+    ----------
+    blocks : list[Block]
+        The blocks to store
+    codec : str
+        The codec of the closed segments, None to keep them raw
+    segment_size : int
+        The size after which a new segment is started
+    reads : int
+        The number of random reads with warm caches
+
+    Returns
+    -------
+    dict
+        The size of the segments, the write time and the mean read latencies
+    """
+    with TemporaryDirectory() as directory:
+        store = BlockStore(directory, segment_size, codec=codec, hot_segments=0)
+        started = time.perf_counter()
+        for block in blocks:
+            store.append(block)
+        written = time.perf_counter() - started
+        size = segments_size(directory)
+        firsts = {}
+        for height, entry in enumerate(store.entries):
+            firsts.setdefault(entry[1], height)
+        store.close()
+
+        store = BlockStore(directory, segment_size, codec=codec, hot_segments=0)
+        started = time.perf_counter()
+        for height in firsts.values():
+            store.read(height)
+        cold = (time.perf_counter() - started) / len(firsts)
+        heights = [random.randrange(len(blocks)) for _ in range(reads)]
+        started = time.perf_counter()
+        for height in heights:
+            store.read(height)
+        warm = (time.perf_counter() - started) / reads
+        store.close()
+    return {
+        "size": size,
+        "segments": len(firsts),
+        "write": written,
+        "cold": cold,
+        "warm": warm,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--blocks", type=int, default=200)
+    parser.add_argument("--transactions", type=int, default=25)
+    parser.add_argument("--wallets", type=int, default=20)
+    parser.add_argument("--segment-size", type=int, default=256 * 1024)
+    parser.add_argument("--reads", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    blocks = generate_blocks(args.blocks, args.transactions, args.wallets)
+    results = {
+        codec: measure(blocks, codec, args.segment_size, args.reads)
+        for codec in [None, *CODECS]
+    }
+    raw = results[None]["size"]
+    print(
+        f"{args.blocks} blocks of {args.transactions} transactions, "
+        f"{results[None]['segments']} segments of {args.segment_size} bytes, "
+        f"{SEGMENT_CACHE_SIZE} decompressed segments cached"
+    )
+    print(
+        f"{'codec':<6} {'bytes':>10} {'ratio':>6} {'write s':>8} "
+        f"{'cold read us':>13} {'warm read us':>13}"
+    )
+    for codec, result in results.items():
+        print(
+            f"{codec or 'raw':<6} {result['size']:>10} "
+            f"{raw / result['size']:>6.2f} {result['write']:>8.3f} "
+            f"{result['cold'] * 1e6:>13.1f} {result['warm'] * 1e6:>13.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
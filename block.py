@@ -1,50 +1,191 @@
-import random
-from dataclasses import dataclass
-from datetime import datetime
 from hashlib import sha256
-from pickle import dumps
+from json import dumps, loads
+from struct import Struct
+from threading import Event
 
 from datastructs import Array
-from transaction import Transaction
+from difficulty import bits_to_target
+from merkle import merkle_proof, merkle_root
+from transaction import Transaction, now
+
+HASH_SIZE = 32
+ADDRESS_SIZE = 48
+NONCE_SIZE = 8
+# the previous hash of the genesis block
+NULL_HASH = bytes(HASH_SIZE)
+NONCE_LIMIT = 2 ** (NONCE_SIZE * 8)
+CHECK_INTERVAL = 10000
+MAX_BLOCK_TRANSACTIONS = 1024
+# previous_hash, merkle_root, miner_address, height, timestamp, difficulty,
+# block_size, nonce
+HEADER_LAYOUT = Struct(f">{HASH_SIZE}s{HASH_SIZE}s{ADDRESS_SIZE}sQQIIQ")
+HEADER_SIZE = HEADER_LAYOUT.size
+
+
+def pack_hex(value: str, size: int) -> bytes:
+    """
+    Converts a hex hash or address to fixed size raw bytes, "0" is encoded as zeros
+
+    Parameters
+    ----------
+    value : str
+        The hex string to convert
+    size : int
+        The number of bytes of the encoded value
+
+    Returns
+    -------
+    bytes
+        The raw bytes of the value
+    """
+    if value is None or value == "0":
+        return bytes(size)
+    raw = bytes.fromhex(value)
+    if len(raw) != size:
+        raise ValueError(f"Expected {size} bytes, got {len(raw)}")
+    return raw
 
 
-@dataclass
 class BlockHeader:
     """
     BlockHeader
 
     Attributes
     ----------
-    previous_hash : str
+    previous_hash : bytes
         The hash of the previous block in the chain.
-    miner_address : str
+    merkle_root : bytes
+        The root of the merkle tree of the transaction ids of the block.
+    miner_address : bytes
         The address of the miner who mined the block.
     difficulty: int
-        The difficulty of the block.
+        The compact encoding of the target the block hash must not exceed.
     timestamp : int
-        The time the block was mined.
+        The time the block was mined, in microseconds.
     height: int
         The height of the block.
     nonce : int
         The nonce used to generate the hash.
     block_size: int
         The number of transactions in the block.
-    hash : str
+    hash : bytes
         The hash of the block.
     """
 
-    previous_hash: str = None
-    miner_address: str = None
-    difficulty: int = None
-    timestamp: int = None
-    height: int = None
-    nonce: int = None
-    block_size: int = None
-    hash: str = None
+    __slots__ = (
+        "previous_hash",
+        "merkle_root",
+        "miner_address",
+        "difficulty",
+        "timestamp",
+        "height",
+        "nonce",
+        "block_size",
+        "hash",
+    )
+
+    def __init__(
+        self,
+        previous_hash: bytes = None,
+        merkle_root: bytes = None,
+        miner_address: bytes = None,
+        difficulty: int = None,
+        timestamp: int = None,
+        height: int = None,
+        nonce: int = None,
+        block_size: int = None,
+        hash: bytes = None,
+    ) -> None:
+        self.previous_hash: bytes = previous_hash
+        self.merkle_root: bytes = merkle_root
+        self.miner_address: bytes = miner_address
+        self.difficulty: int = difficulty
+        self.timestamp: int = timestamp
+        self.height: int = height
+        self.nonce: int = nonce
+        self.block_size: int = block_size
+        self.hash: bytes = hash
+
+    def _fields(self) -> dict:
+        """Returns the fields of the block header by name."""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __eq__(self, other) -> bool:
+        """Returns True if every field of the two block headers is equal."""
+        if not isinstance(other, BlockHeader):
+            return NotImplemented
+        return self._fields() == other._fields()
+
+    def __repr__(self) -> str:
+        """Returns the fields of the block header."""
+        fields = ", ".join(
+            f"{name}={value!r}" for name, value in self._fields().items()
+        )
+        return f"BlockHeader({fields})"
 
     def __str__(self) -> str:
         """Returns the string representation of the block header."""
-        return "BlockHeader: " + str(self.__dict__)
+        return "BlockHeader: " + str(self._fields())
+
+    def __bytes__(self) -> bytes:
+        """Returns the fixed layout binary encoding of the block header."""
+        return HEADER_LAYOUT.pack(
+            self.previous_hash or b"",
+            self.merkle_root or b"",
+            self.miner_address or b"",
+            self.height or 0,
+            self.timestamp or 0,
+            self.difficulty or 0,
+            self.block_size or 0,
+            self.nonce or 0,
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "BlockHeader":
+        """
+        Creates a block header from its binary encoding
+
+        Parameters
+        ----------
+        data : bytes
+            The encoded block header
+
+        Returns
+        -------
+        BlockHeader
+            The decoded block header, with its hash
+        """
+        (
+            previous_hash,
+            merkle_root,
+            miner_address,
+            height,
+            timestamp,
+            difficulty,
+            block_size,
+            nonce,
+        ) = HEADER_LAYOUT.unpack(data)
+        return cls(
+            previous_hash=previous_hash,
+            merkle_root=merkle_root,
+            miner_address=miner_address,
+            difficulty=difficulty,
+            timestamp=timestamp,
+            height=height,
+            nonce=nonce,
+            block_size=block_size,
+            hash=sha256(data).digest(),
+        )
+
+    @property
+    def prefix(self) -> bytes:
+        """Returns the encoded header fields that stay constant while mining."""
+        return bytes(self)[:-NONCE_SIZE]
+
+    @property
+    def target(self) -> bytes:
+        """Returns the largest hash digest that meets the difficulty."""
+        return bits_to_target(self.difficulty).to_bytes(HASH_SIZE, "big")
 
 
 class Block:
@@ -78,15 +219,7 @@ class Block:
         Block
             The block instance created from the json dict
         """
-        header = BlockHeader()
-        header.previous_hash = json_data["previous_hash"]
-        header.miner_address = json_data["miner_address"]
-        header.difficulty = json_data["difficulty"]
-        header.timestamp = json_data["timestamp"]
-        header.height = json_data["height"]
-        header.hash = json_data["hash"]
-        header.nonce = json_data["nonce"]
-        header.block_size = json_data["block_size"]
+        header = BlockHeader.from_bytes(bytes.fromhex(json_data["header"]))
         transactions = Array(
             Transaction,
             len(json_data["transactions"]),
@@ -94,11 +227,40 @@ class Block:
         )
         return cls(header, transactions)
 
+    def __bytes__(self) -> bytes:
+        """Returns the binary encoding, the header followed by the transactions json."""
+        transactions = [t.to_dict(include_signature=True) for t in self.transactions]
+        return bytes(self.header) + dumps(transactions, separators=(",", ":")).encode()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Block":
+        """
+        Create a block from its binary encoding
+
+        Parameters
+        ----------
+        data : bytes
+            The encoded block
+
+        Returns
+        -------
+        Block
+            The decoded block
+        """
+        header = BlockHeader.from_bytes(data[:HEADER_SIZE])
+        transactions = loads(data[HEADER_SIZE:])
+        transactions = Array(
+            Transaction,
+            len(transactions),
+            [Transaction.from_json(t) for t in transactions],
+        )
+        return cls(header, transactions)
+
     @classmethod
     def create(
         cls,
-        previous_hash: str,
-        miner_address: str,
+        previous_hash: bytes,
+        miner_address: bytes,
         difficulty: int,
         height: int,
         transactions: Array,
@@ -108,12 +270,12 @@ class Block:
 
         Parameters
         ----------
-        previous_hash : str
+        previous_hash : bytes
             The hash of the previous block in the chain.
-        miner_address : str
+        miner_address : bytes
             The address of the miner who mined the block.
         difficulty: int
-            The difficulty of the block.
+            The compact target of the block.
         height: int
             The height of the block.
         transactions : list[Transaction]
@@ -128,57 +290,105 @@ class Block:
         header.previous_hash = previous_hash
         header.miner_address = miner_address
         header.difficulty = difficulty
-        header.timestamp = datetime.now().timestamp()
+        header.timestamp = now()
         header.height = height
         transactions = Array(Transaction, len(transactions), transactions)
-        return cls(header, transactions)
+        block = cls(header, transactions)
+        block.update_merkle_root()
+        return block
 
     @property
-    def hash(self) -> str:
+    def hash(self) -> bytes:
         """Returns the hash of the block."""
         return self.header.hash
 
+    @property
+    def txids(self) -> list[bytes]:
+        """Returns the ids of the transactions of the block, in order."""
+        return [transaction.txid for transaction in self.transactions]
+
+    def update_merkle_root(self) -> None:
+        """Commit the header to the current transactions of the block"""
+        self.header.merkle_root = merkle_root(self.txids)
+
+    def merkle_proof(self, index: int) -> list[tuple[bytes, bool]]:
+        """
+        Build the inclusion proof of a transaction of the block
+
+        Parameters
+        ----------
+        index : int
+            The position of the transaction in the block
+
+        Returns
+        -------
+        list[tuple[bytes, bool]]
+            The proof, to be checked with merkle.verify_proof against the merkle root
+        """
+        return merkle_proof(self.txids, index)
+
     def to_dict(self) -> dict:
         """Returns the block as a dict"""
         return {
-            "previous_hash": self.header.previous_hash,
-            "miner_address": self.header.miner_address,
-            "difficulty": self.header.difficulty,
-            "timestamp": self.header.timestamp,
-            "height": self.header.height,
-            "hash": self.header.hash,
-            "nonce": self.header.nonce,
-            "block_size": self.header.block_size,
-            "transactions": [t.to_dict() for t in self.transactions],
+            "header": bytes(self.header).hex(),
+            "transactions": [
+                t.to_dict(include_signature=True) for t in self.transactions
+            ],
         }
 
     def hash_block(self) -> None:
         """Calculate the hash of the block header"""
-        self.header.hash = sha256(dumps(self.header.__dict__)).hexdigest()
+        self.header.hash = sha256(bytes(self.header)).digest()
+
+    def valid_proof(self) -> bool:
+        """Returns True if the hash of the block meets its difficulty."""
+        return self.header.hash <= self.header.target
 
-    def proof_of_work(self, isfound: callable) -> None:
+    def proof_of_work(
+        self,
+        cancel: Event = None,
+        start: int = 0,
+        end: int = NONCE_LIMIT,
+        progress: callable = None,
+    ) -> bool:
         """
-        Proof of work algorithm.
+        Proof of work algorithm, walks the nonces in order.
+
+        The constant header fields are hashed once and the sha256 state is copied
+        for every attempt, so only the nonce bytes are hashed per nonce. The cancel
+        event is checked and the progress reported once every CHECK_INTERVAL attempts.
 
         Parameters
         ----------
-        isfound : callable
-            A function that returns True if the block is found.
+        cancel : Event
+            Set when the block was found by a peer and mining should stop.
+        start : int
+            The first nonce to try.
+        end : int
+            The end of the nonce range (exclusive).
+        progress : callable
+            A function called with the number of attempts made so far.
+
+        Returns
+        -------
+        bool
+            True if a valid nonce was found, False otherwise
         """
-        start, end = 0, 1000000
-        while True:
-            nonce_list = [i for i in range(start, end)]
-            for i in nonce_list:
-                if isfound():
-                    return False
-                n = random.choice(nonce_list)
-                self.header.nonce = n
-                self.hash_block()
-                if (
-                    self.header.hash[: self.header.difficulty]
-                    == "0" * self.header.difficulty
-                ):
+        prefix = sha256(self.header.prefix)
+        target = self.header.target
+        for chunk in range(start, end, CHECK_INTERVAL):
+            if progress is not None:
+                progress(chunk - start)
+            if cancel is not None and cancel.is_set():
+                return False
+            for nonce in range(chunk, min(chunk + CHECK_INTERVAL, end)):
+                attempt = prefix.copy()
+                attempt.update(nonce.to_bytes(NONCE_SIZE, "big"))
+                digest = attempt.digest()
+                if digest <= target:
+                    if progress is not None:
+                        progress(nonce - start + 1)
+                    self.header.nonce = nonce
+                    self.header.hash = digest
                     return True
-            else:
-                start = end
-                end = end * 2
+        return False
@@ -1,7 +1,24 @@
-from datetime import datetime
-from datastructs import Queue
-from block import Block
-from transaction import Transaction
+from threading import Event, RLock
+from typing import Iterable
+
+from block import ADDRESS_SIZE, NULL_HASH, Block
+from chain import Chain
+from difficulty import MAX_BITS, RETARGET_WINDOW, retarget, work
+from index import AddressIndex, BalanceIndex, TransactionIndex
+from mempool import Mempool
+from store import BlockHandle, BlockStore, PrunedBlockError
+from transaction import (
+    REWARD_SENDER,
+    TIMESTAMP_SCALE,
+    Transaction,
+    from_hex,
+    now,
+    to_hex,
+)
+from verification import verify_transaction
+
+# the number of blocks below the tip a reorganization may undo
+MAX_FORK_DEPTH = 100
 
 
 class Blockchain:
@@ -10,15 +27,52 @@ class Blockchain:
 
     Attributes
     ----------
-    chain : dict
-        The chain containing all the valid blocks
-    ether : Queue[Transaction]
-        The list of transactions in the ether
+    chain : Chain
+        The chain containing all the valid blocks, indexed by height and hash
+    ether : Mempool
+        The pending transactions
+    new_block : Event
+        Set whenever a block is added to the chain
+    lock : RLock
+        Held while the chain and its state change, readers that need a consistent
+        view across several fields hold it too
+    balances : BalanceIndex
+        The balance of every address at the tip of the chain
+    work : dict[int, int]
+        The cumulative work of the chain at the tip and the heights a
+        reorganization may fork from
+    undo : dict
+        The balance undo data of the last undo_depth blocks by height
+    undo_depth : int
+        The number of recent blocks that can be undone
+    addresses : AddressIndex
+        The location of the transactions of every address
+    transactions : TransactionIndex
+        The location of every transaction by id
+    store : BlockStore
+        The store every block is written to as it is added, None if not persisted
+    snapshots : SnapshotStore
+        The store the state is periodically saved to, None if not persisted
+    retention : int
+        The number of recent blocks whose bodies are kept, None keeps every block
     """
 
-    def __init__(self, chain: dict) -> None:
-        self.chain = chain
-        self.ether = Queue()
+    def __init__(self, blocks: Iterable[Block] = ()) -> None:
+        self.chain = Chain()
+        self.ether = Mempool()
+        self.new_block = Event()
+        self.lock = RLock()
+        self.balances = BalanceIndex()
+        self.work: dict[int, int] = {}
+        self.undo = {}
+        self.undo_depth: int = MAX_FORK_DEPTH
+        self.addresses = AddressIndex()
+        self.transactions = TransactionIndex()
+        self.store = None
+        self.snapshots = None
+        self.retention = None
+        for block in blocks:
+            self.add_block(block)
 
     @classmethod
     def from_json(cls, json_data: dict) -> "Blockchain":
@@ -35,8 +89,7 @@ class Blockchain:
         Blockchain
             The blockchain instance created from the json string
         """
-        chain = {height: Block.from_json(block) for height, block in json_data.items()}
-        return cls(chain)
+        return cls(Block.from_json(block) for block in json_data.values())
 
     @classmethod
     def generate(cls) -> "Blockchain":
@@ -48,10 +101,94 @@ class Blockchain:
         Blockchain
             The new blockchain
         """
-        chain = cls({})
+        chain = cls()
         chain.genesis()
         return chain
 
+    @classmethod
+    def from_store(cls, store: BlockStore, state: dict = None) -> "Blockchain":
+        """
+        Create a blockchain from the blocks of a store, the chain holds lazy handles
+        so only the blocks in the store cache are kept decoded
+
+        Parameters
+        ----------
+        store : BlockStore
+            The store, its blocks were validated before they were written
+        state : dict
+            A snapshot taken at a stored block, only the later blocks are replayed
+
+        Returns
+        -------
+        Blockchain
+            The blockchain of the stored blocks, persisted to the store
+        """
+        start = state["height"] + 1 if state is not None else 0
+        if store.pruned > start:
+            raise PrunedBlockError(
+                f"The blocks below {store.pruned} were pruned and no snapshot covers them"
+            )
+        chain = cls()
+        if state is not None:
+            chain.restore(state)
+            for height in range(start):
+                chain.chain.append(store.handle(height))
+        for height in range(start, len(store)):
+            chain.add_block(store.handle(height))
+        chain.store = store
+        return chain
+
+    def snapshot(self) -> dict:
+        """
+        Get the derived state of the chain
+
+        Returns
+        -------
+        dict
+            The balances, undo data, cumulative work and indexes, tagged with the
+            tip height and hash
+        """
+        with self.lock:
+            return {
+                "height": self.height,
+                "hash": to_hex(self.last_block.hash),
+                "balances": self.balances.to_dict(),
+                "undo": {
+                    height: {
+                        to_hex(address): balance for address, balance in undo.items()
+                    }
+                    for height, undo in self.undo.items()
+                },
+                "work": dict(self.work),
+                "addresses": self.addresses.to_dict(),
+                "transactions": self.transactions.to_dict(),
+            }
+
+    def restore(self, state: dict) -> None:
+        """
+        Restore the derived state of the chain from a snapshot
+
+        Parameters
+        ----------
+        state : dict
+            The state returned by snapshot
+        """
+        self.balances = BalanceIndex.from_json(state["balances"])
+        self.undo = {
+            int(height): {
+                from_hex(address): balance for address, balance in undo.items()
+            }
+            for height, undo in state["undo"].items()
+            if int(height) > state["height"] - self.undo_depth
+        }
+        self.work = {
+            int(height): total
+            for height, total in state["work"].items()
+            if int(height) >= state["height"] - self.undo_depth
+        }
+        self.addresses = AddressIndex.from_json(state["addresses"])
+        self.transactions = TransactionIndex.from_json(state["transactions"])
+
     def to_dict(self) -> dict:
         """
         Convert the blockchain to a json string
@@ -61,8 +198,11 @@ class Blockchain:
         str
             The blockchain converted to a json string
         """
-        json_data = {height: block.to_dict() for height, block in self.chain.items()}
-        return json_data
+        with self.lock:
+            json_data = {
+                str(height): block.to_dict() for height, block in enumerate(self.chain)
+            }
+            return json_data
 
     @property
     def height(self) -> int:
@@ -72,9 +212,9 @@ class Blockchain:
         Returns
         -------
         int
-            The height of the blockchain
+            The height of the last block, the genesis block is 0
         """
-        return len(self.chain)
+        return self.chain.height
 
     @property
     def last_block(self) -> Block:
@@ -86,7 +226,19 @@ class Blockchain:
         Block
             The last block in the blockchain
         """
-        return self.chain[str(self.height)]
+        return self.chain.tip
+
+    @property
+    def total_work(self) -> int:
+        """
+        Get the cumulative work of the chain
+
+        Returns
+        -------
+        int
+            The expected number of hashes needed to mine every block of the chain
+        """
+        return self.work.get(self.height, 0)
 
     @property
     def block_reached(self) -> bool:
@@ -102,23 +254,38 @@ class Blockchain:
             return True
         return False
 
-    def calc_reward(self) -> float:
+    def calc_reward(self) -> int:
         """
-        Calculate the reward for the last block
+        Calculate the reward for the next block
 
         Returns
         -------
-        float
-            The reward for the last block
+        int
+            The reward for the next block
         """
         total_reward = 17179869183
         max_reward = 50
-        reward = total_reward / self.height ** 2
+        reward = total_reward // len(self.chain) ** 2
         if reward > max_reward:
             reward = max_reward
         return reward
 
-    def add_transaction(self, transaction: Transaction) -> None:
+    def next_difficulty(self) -> int:
+        """
+        Calculate the difficulty of the next block from the last block times
+
+        Returns
+        -------
+        int
+            The compact target of the next block
+        """
+        timestamps = [
+            block.header.timestamp / TIMESTAMP_SCALE
+            for block in self.chain[-RETARGET_WINDOW:]
+        ]
+        return retarget(timestamps, self.last_block.header.difficulty, len(self.chain))
+
+    def add_transaction(self, transaction: Transaction) -> bool:
         """
         Add a transaction to the ether
 
@@ -126,8 +293,24 @@ class Blockchain:
         ----------
         transaction : Transaction
             The transaction to add to the ether
+
+        Returns
+        -------
+        bool
+            True if the transaction was added, False if it is already pending,
+            confirmed, invalid, overspends the sender balance or was evicted
         """
-        self.ether.enqueue(transaction)
+        if transaction.sender == REWARD_SENDER or transaction.amount < 0:
+            return False
+        if not verify_transaction(transaction):
+            return False
+        with self.lock:
+            if transaction.txid in self.transactions or transaction.txid in self.ether:
+                return False
+            pending = sum(t.amount for t in self.ether.from_sender(transaction.sender))
+            if pending + transaction.amount > self.balances.get(transaction.sender):
+                return False
+            return self.ether.add(transaction)
 
     def add_block(self, block: Block) -> None:
         """
@@ -138,9 +321,165 @@ class Blockchain:
         block : Block
             The block to add to the blockchain
         """
-        self.chain.update({str(self.height + 1): block})
+        with self.lock:
+            total_work = self.total_work + work(block.header.difficulty)
+            height = self.chain.append(block)
+            self.work[height] = total_work
+            # a fork starts at most undo_depth blocks below the tip
+            self.work.pop(height - self.undo_depth - 1, None)
+            self.undo[height] = self.balances.apply_block(block)
+            self.undo.pop(height - self.undo_depth, None)
+            self.addresses.apply_block(block, height)
+            self.transactions.apply_block(block, height)
+            self.ether.remove_transactions(block.transactions)
+            if self.store is not None:
+                # the chain keeps a lazy handle, the block stays in the store cache
+                self.chain[height] = self.store.handle(self.store.append(block))
+            if (
+                self.snapshots is not None
+                and len(self.chain) % self.snapshots.interval == 0
+            ):
+                self.snapshots.save(self.snapshot())
+            if self.retention is not None and self.store is not None:
+                self.prune(height - self.retention + 1)
+            self.new_block.set()
 
-    def get_chaininfo(self) -> tuple[int, str]:
+    def prune(self, height: int) -> None:
+        """
+        Drop the bodies, undo data and address history of the blocks below a height,
+        whole store segments are deleted so fewer blocks may be pruned
+
+        Parameters
+        ----------
+        height : int
+            The height of the first block that is kept
+        """
+        if not self.store.prunable(height):
+            return
+        if self.snapshots is not None:
+            # a restart has to start from a snapshot above the pruned blocks
+            self.snapshots.save(self.snapshot())
+        start = self.store.pruned
+        pruned = self.store.prune(height)
+        for stale in range(start, pruned):
+            self.undo.pop(stale, None)
+        self.addresses.prune(pruned)
+
+    def pop_block(self) -> Block:
+        """
+        Remove the last block from the blockchain and undo its transactions
+
+        Returns
+        -------
+        Block
+            The removed block, decoded as it is removed from the store
+        """
+        with self.lock:
+            height = self.height
+            if height not in self.undo:
+                raise PrunedBlockError(
+                    f"The block at height {height} can no longer be undone"
+                )
+            block = self.chain.tip
+            if isinstance(block, BlockHandle):
+                block = block.block
+            self.balances.undo_block(self.undo.pop(height))
+            self.addresses.undo_block(block, height)
+            self.transactions.undo_block(block)
+            if self.store is not None:
+                self.store.truncate(height)
+            self.chain.pop()
+            self.work.pop(height)
+            return block
+
+    def attach(self, store: BlockStore) -> None:
+        """
+        Persist the chain to a block store, the blocks the store already holds are
+        kept and only the ones after the last common block are written
+
+        Parameters
+        ----------
+        store : BlockStore
+            The store to write the blocks to
+        """
+        common = 0
+        for block in self.chain:
+            if common >= len(store) or store.entries[common][0] != block.hash:
+                break
+            common += 1
+        store.truncate(common)
+        for height in range(common, len(self.chain)):
+            self.chain[height] = store.handle(store.append(self.chain[height]))
+        self.store = store
+
+    def get_headers(self, start: int = 0) -> list[bytes]:
+        """
+        Get the encoded headers of the blocks from the given height
+
+        Parameters
+        ----------
+        start : int
+            The height of the first header
+
+        Returns
+        -------
+        list[bytes]
+            The binary encoded headers
+        """
+        with self.lock:
+            return [bytes(block.header) for block in self.chain[start:]]
+
+    def get_transaction(self, txid: bytes) -> tuple[Transaction, int, int]:
+        """
+        Get a transaction of the chain by id
+
+        Parameters
+        ----------
+        txid : bytes
+            The id of the transaction
+
+        Returns
+        -------
+        tuple[Transaction, int, int]
+            The transaction, the height of its block and its position in the block,
+            None if the transaction is not in the chain or its block was pruned
+        """
+        with self.lock:
+            location = self.transactions.get(txid)
+            if location is None:
+                return None
+            height, position = location
+            if self.store is not None and height < self.store.pruned:
+                return None
+            return self.chain[height].transactions[position], height, position
+
+    def get_merkle_proof(
+        self, height: int, index: int
+    ) -> tuple[bytes, list[tuple[bytes, bool]], bytes]:
+        """
+        Get the inclusion proof of a transaction
+
+        Parameters
+        ----------
+        height : int
+            The height of the block containing the transaction
+        index : int
+            The position of the transaction in the block
+
+        Returns
+        -------
+        tuple[bytes, list[tuple[bytes, bool]], bytes]
+            The transaction id, its proof and the merkle root of the block
+        """
+        with self.lock:
+            block = self.chain[height]
+            return (
+                block.transactions[index].txid,
+                block.merkle_proof(index),
+                block.header.merkle_root,
+            )
+
+    def get_chaininfo(self) -> tuple[int, bytes]:
         """
         Get the chain information
 
@@ -149,7 +488,8 @@ class Blockchain:
         tuple[int, str]
             The chain information
         """
-        return self.height, self.last_block.hash
+        with self.lock:
+            return self.height, self.last_block.hash
 
     def genesis(self) -> bool:
         """
@@ -160,22 +500,23 @@ class Blockchain:
         bool
             True if the genesis block was created, False otherwise
         """
-        if self.height == 0:
+        if len(self.chain) == 0:
             tsx = Transaction()
-            tsx.sender = "0"
-            tsx.recipient = "612cc49836a4c01ca1f3fbe71972fac29c79e654ac60a48c132d0c5f69cd84cc6997a7e8d4d1173462fb2a6372ea7150"
+            tsx.sender = REWARD_SENDER
+            tsx.recipient = bytes.fromhex(
+                "612cc49836a4c01ca1f3fbe71972fac29c79e654ac60a48c132d0c5f69cd84cc6997a7e8d4d1173462fb2a6372ea7150"
+            )
             tsx.amount = 1000
-            tsx.nonce = 0
-            tsx.timestamp = datetime.now().timestamp()
+            tsx.timestamp = now()
 
             genesis = Block.create(
-                "0",
-                "0",
-                0,
+                NULL_HASH,
+                bytes(ADDRESS_SIZE),
+                MAX_BITS,
                 0,
                 [tsx],
             )
-            genesis.hash_block()
+            genesis.proof_of_work()
             self.add_block(genesis)
             return True
         else:
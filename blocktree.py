@@ -0,0 +1,244 @@
+from block import Block, BlockHeader
+from blockchain import MAX_FORK_DEPTH, Blockchain
+from difficulty import RETARGET_WINDOW, retarget, work
+from transaction import REWARD_SENDER, TIMESTAMP_SCALE
+from validation import body_error, check_header, state_error, structure_error
+from verification import verify_batch
+
+
+class BranchBlock:
+    """
+    A valid block that is not on the main chain
+
+    Attributes
+    ----------
+    block : Block
+        The block
+    height : int
+        The height of the block
+    work : int
+        The cumulative work of the branch up to the block
+    """
+
+    __slots__ = ("block", "height", "work")
+
+    def __init__(self, block: Block, height: int, work: int) -> None:
+        self.block: Block = block
+        self.height: int = height
+        self.work: int = work
+
+
+class BlockTree:
+    """
+    The competing branches of a blockchain. The main chain is the blockchain
+    itself, the tree keeps the valid blocks of the other branches by hash. The tip
+    is the block with the most cumulative work, when a branch overtakes the main
+    chain only the blocks after the fork point are undone and applied.
+
+    Attributes
+    ----------
+    blockchain : Blockchain
+        The main chain
+    branches : dict[bytes, BranchBlock]
+        The blocks of the side branches by hash
+    invalid : set[bytes]
+        The hashes of the blocks that failed validation
+    max_depth : int
+        The number of blocks below the tip a fork may start at
+    """
+
+    def __init__(self, blockchain: Blockchain, max_depth: int = MAX_FORK_DEPTH) -> None:
+        self.blockchain: Blockchain = blockchain
+        self.branches: dict[bytes, BranchBlock] = {}
+        self.invalid: set[bytes] = set()
+        self.max_depth: int = max_depth
+
+    def __contains__(self, hash: bytes) -> bool:
+        """Returns True if a block with this hash is on any branch."""
+        return hash in self.blockchain.chain or hash in self.branches
+
+    def add(self, block: Block) -> bool:
+        """
+        Add a block to the branch of its parent, the main chain is reorganized if
+        the branch now has more work
+
+        Parameters
+        ----------
+        block : Block
+            The block to add
+
+        Returns
+        -------
+        bool
+            True if the block is valid and was added, False if it is known, invalid,
+            its parent is unknown or it forks too deep
+        """
+        with self.blockchain.lock:
+            hash = block.hash
+            if hash in self or hash in self.invalid:
+                return False
+            chain = self.blockchain.chain
+            parent = block.header.previous_hash
+            height = chain.height_of(parent)
+            if height is not None:
+                parent_work = self.blockchain.work.get(height)
+            elif parent in self.branches:
+                node = self.branches[parent]
+                height, parent_work = node.height, node.work
+            else:
+                return False
+            height += 1
+            if height <= self.blockchain.height - self.max_depth or parent_work is None:
+                return False
+            if self.check(block, height) is not None:
+                if body_error(block) is None:
+                    # a mutated body does not make the header invalid
+                    self.invalid.add(hash)
+                return False
+            if parent == chain.tip.hash:
+                if state_error(self.blockchain, block, height) is not None:
+                    self.invalid.add(hash)
+                    return False
+                self.blockchain.add_block(block)
+                self.sweep()
+                return True
+            self.branches[hash] = BranchBlock(
+                block, height, parent_work + work(block.header.difficulty)
+            )
+            if self.branches[hash].work > self.blockchain.total_work:
+                self.reorganize(hash)
+            return hash in self
+
+    def check(self, block: Block, height: int) -> str:
+        """
+        Checks a block against its branch, the state is checked when it is applied
+
+        Parameters
+        ----------
+        block : Block
+            The block to check
+        height : int
+            The height of the block
+
+        Returns
+        -------
+        str
+            Why the block is invalid, None if it is valid so far
+        """
+        headers = self.headers(block.header.previous_hash, RETARGET_WINDOW)
+        timestamps = [header.timestamp / TIMESTAMP_SCALE for header in headers]
+        bits = retarget(timestamps, headers[-1].difficulty, height)
+        reason = structure_error(
+            block, height, block.header.previous_hash, bits, timestamps
+        )
+        if reason is not None:
+            return reason
+        if not check_header(bytes(block.header), block.hash):
+            return "hash does not meet the proof of work"
+        if not all(verify_batch(block.transactions)):
+            return "has an invalid signature"
+        return None
+
+    def headers(self, hash: bytes, count: int) -> list[BlockHeader]:
+        """
+        Get the headers of a block and of its ancestors
+
+        Parameters
+        ----------
+        hash : bytes
+            The hash of the block
+        count : int
+            The maximum number of headers
+
+        Returns
+        -------
+        list[BlockHeader]
+            The headers, oldest first
+        """
+        headers = []
+        while hash in self.branches and len(headers) < count:
+            header = self.branches[hash].block.header
+            headers.append(header)
+            hash = header.previous_hash
+        height = self.blockchain.chain.height_of(hash)
+        if height is not None and len(headers) < count:
+            start = max(0, height + 1 - (count - len(headers)))
+            for block in reversed(self.blockchain.chain[start : height + 1]):
+                headers.append(block.header)
+        return headers[::-1]
+
+    def reorganize(self, hash: bytes) -> bool:
+        """
+        Make a side branch the main chain, the blocks of the main chain after the
+        fork point are undone and moved to the branches, then the blocks of the
+        side branch are applied. If one of them is invalid the old chain is restored.
+
+        Parameters
+        ----------
+        hash : bytes
+            The hash of the tip of the side branch
+
+        Returns
+        -------
+        bool
+            True if the side branch is now the main chain
+        """
+        blockchain = self.blockchain
+        branch = []
+        while hash in self.branches:
+            branch.append(self.branches[hash])
+            hash = self.branches[hash].block.header.previous_hash
+        branch.reverse()
+        fork = blockchain.chain.height_of(hash)
+        if fork is None:
+            return False
+        if any(
+            height not in blockchain.undo
+            for height in range(fork + 1, blockchain.height + 1)
+        ):
+            # the fork point is below the pruned blocks
+            return False
+        disconnected = []
+        while blockchain.height > fork:
+            disconnected.append(self.disconnect())
+        for index, node in enumerate(branch):
+            if state_error(blockchain, node.block, node.height) is not None:
+                for invalid in branch[index:]:
+                    self.invalid.add(invalid.block.hash)
+                    del self.branches[invalid.block.hash]
+                while blockchain.height > fork:
+                    self.disconnect()
+                for block in reversed(disconnected):
+                    self.connect(block.hash)
+                self.sweep()
+                return False
+            self.connect(node.block.hash)
+        for block in disconnected:
+            for transaction in block.transactions:
+                if transaction.sender != REWARD_SENDER:
+                    blockchain.add_transaction(transaction)
+        self.sweep()
+        return True
+
+    def disconnect(self) -> Block:
+        """Undoes the tip of the main chain and moves it to the branches."""
+        height, total_work = self.blockchain.height, self.blockchain.total_work
+        block = self.blockchain.pop_block()
+        self.branches[block.hash] = BranchBlock(block, height, total_work)
+        return block
+
+    def connect(self, hash: bytes) -> None:
+        """Applies a block of the branches on top of the main chain."""
+        self.blockchain.add_block(self.branches.pop(hash).block)
+
+    def sweep(self) -> None:
+        """Drops the branch blocks that fork too deep or lost their parent."""
+        floor = self.blockchain.height - self.max_depth
+        for hash, node in sorted(
+            self.branches.items(), key=lambda item: item[1].height
+        ):
+            parent = node.block.header.previous_hash
+            if node.height <= floor or (
+                parent not in self.branches and parent not in self.blockchain.chain
+            ):
+                del self.branches[hash]
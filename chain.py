@@ -0,0 +1,135 @@
+from typing import Iterable, Iterator, Union
+
+from block import Block
+
+
+class Chain:
+    """
+    The blocks of a chain in a dense array indexed by height, with an index of the
+    height of every block by hash. The genesis block is at height 0, so the index
+    of every block is the height in its header.
+
+    Attributes
+    ----------
+    blocks : list[Block]
+        The blocks in chain order, the stored ones as lazy handles
+    heights : dict[bytes, int]
+        The height of every block by hash
+    """
+
+    def __init__(self, blocks: Iterable[Block] = ()) -> None:
+        self.blocks: list[Block] = []
+        self.heights: dict[bytes, int] = {}
+        for block in blocks:
+            self.append(block)
+
+    def __len__(self) -> int:
+        """Returns the number of blocks."""
+        return len(self.blocks)
+
+    def __iter__(self) -> Iterator[Block]:
+        """Iterates over the blocks from the genesis block."""
+        return iter(self.blocks)
+
+    def __contains__(self, hash: bytes) -> bool:
+        """Returns True if a block with this hash is in the chain."""
+        return hash in self.heights
+
+    def __getitem__(self, height: Union[int, slice]) -> Union[Block, list[Block]]:
+        """Returns the block at a height, or the blocks of a range of heights."""
+        return self.blocks[height]
+
+    def __setitem__(self, height: int, block: Block) -> None:
+        """Replaces the block at a height, with the stored handle of the block."""
+        del self.heights[self.blocks[height].hash]
+        self.blocks[height] = block
+        self.heights[block.hash] = height
+
+    @property
+    def height(self) -> int:
+        """Returns the height of the tip, -1 if the chain is empty."""
+        return len(self.blocks) - 1
+
+    @property
+    def tip(self) -> Block:
+        """Returns the last block, None if the chain is empty."""
+        return self.blocks[-1] if self.blocks else None
+
+    def append(self, block: Block) -> int:
+        """
+        Add a block on top of the tip
+
+        Parameters
+        ----------
+        block : Block
+            The block to add
+
+        Returns
+        -------
+        int
+            The height of the block
+        """
+        self.blocks.append(block)
+        self.heights[block.hash] = len(self.blocks) - 1
+        return len(self.blocks) - 1
+
+    def pop(self) -> Block:
+        """Removes and returns the tip."""
+        block = self.blocks.pop()
+        del self.heights[block.hash]
+        return block
+
+    def truncate(self, height: int) -> list[Block]:
+        """
+        Remove every block from a height on
+
+        Parameters
+        ----------
+        height : int
+            The height of the first block to remove
+
+        Returns
+        -------
+        list[Block]
+            The removed blocks, in chain order
+        """
+        removed = self.blocks[height:]
+        for block in removed:
+            del self.heights[block.hash]
+        del self.blocks[height:]
+        return removed
+
+    def height_of(self, hash: bytes) -> int:
+        """Returns the height of the block with a hash, None if it is not found."""
+        return self.heights.get(hash)
+
+    def get(self, hash: bytes) -> Block:
+        """Returns the block with a hash, None if it is not in the chain."""
+        height = self.heights.get(hash)
+        return None if height is None else self.blocks[height]
+
+    def ancestor(self, hash: bytes, depth: int = 1) -> Block:
+        """
+        Get an ancestor of a block of the chain
+
+        Parameters
+        ----------
+        hash : bytes
+            The hash of the block
+        depth : int
+            The number of blocks to go back, 1 is the parent
+
+        Returns
+        -------
+        Block
+            The ancestor, None if the block is not in the chain or the ancestor
+            would be below the genesis block
+        """
+        height = self.heights.get(hash)
+        if height is None or height - depth < 0:
+            return None
+        return self.blocks[height - depth]
+
+    def hashes(self) -> list[bytes]:
+        """Returns the hash of every block, the genesis block first."""
+        return [block.hash for block in self.blocks]
@@ -1,17 +1,22 @@
-import json
 import os
 import time
 import random
-from datetime import datetime
+from dataclasses import asdict
 from logging import RootLogger
 from threading import Thread
 from typing import Optional, Any
 
-from datastructs import Array, Queue
-from block import Block
+from datastructs import Array
+from block import Block, MAX_BLOCK_TRANSACTIONS
 from blockchain import Blockchain
+from index import SpendLedger
+from legacy import LEGACY_PATH, import_blocks
+from miner import Miner
 from peer import Peer, Protocol, preset_protocols
-from transaction import Transaction
+from snapshot import SnapshotStore
+from store import BlockStore, PrunedBlockError
+from transaction import REWARD_SENDER, Transaction, from_hex, now, public_keys
+from verification import verify_batch
 from wallet import Wallet
 
 
@@ -26,7 +31,13 @@ class Daemon:
         blockchain (Blockchain): The blockchain of the node
     """
 
-    def __init__(self, logger: RootLogger) -> None:
+    def __init__(
+        self,
+        logger: RootLogger,
+        mining_workers: int = None,
+        prune_depth: int = None,
+        store_codec: str = "zlib",
+    ) -> None:
         """
         Initialize the daemon
 
@@ -34,13 +45,24 @@ class Daemon:
         ----------
         logger : [RootLogger]
             The logger of the node
+        mining_workers : int
+            The number of processes used to mine, defaults to the number of cores
+        prune_depth : int
+            The number of recent block bodies kept on disk, None keeps every block
+        store_codec : str
+            The codec of the old block store segments, "zlib", "lzma" or None
         """
         self.logger = logger
         self.blockchain: Optional[Blockchain] = None
         self.wallet: Optional[Wallet] = None
         self.peer: Optional[Peer] = None
+        self.store: Optional[BlockStore] = None
+        self.snapshots: Optional[SnapshotStore] = None
         self.mining: bool = False
         self.mining_thread: Thread = None
+        self.miner: Miner = Miner(mining_workers)
+        self.prune_depth: Optional[int] = prune_depth
+        self.store_codec: Optional[str] = store_codec
 
     def ismining(self) -> bool:
         """
@@ -62,28 +84,49 @@ class Daemon:
 
     def stop(self) -> None:
         """This method is used to stop the daemon"""
+        self.miner.close()
         self.save()
         self.logger.info("Daemon stopped")
 
     def load(self) -> None:
         """Loads the blockchain and the wallet"""
         self.logger.info("Loading blockchain")
-        # check if the file blockchain.json exists in data folder
-        notfound = True
-        if os.path.isfile("data/blockchain.json"):
-            with open("data/blockchain.json", "r") as f:
-                data = json.load(f)
-                # check if the file blockchain.json is empty, if not load the blockchain
-                if data:
-                    notfound = False
-                    self.blockchain = Blockchain.from_json(data)
-                    self.logger.info("Blockchain loaded")
-        if notfound:
+        self.store = BlockStore(codec=self.store_codec)
+        blockchain = None
+        self.snapshots = SnapshotStore()
+        if len(self.store):
+            # only validated blocks are written to the store, and only the blocks
+            # after the newest snapshot of this chain are replayed
+            state = self.snapshots.load([entry[0] for entry in self.store.entries])
+            blockchain = Blockchain.from_store(self.store, state)
+        # check if the legacy file blockchain.json exists in data folder
+        elif os.path.isfile(LEGACY_PATH):
+            # the blocks are streamed from the file straight into the store, a file
+            # written by the baseline is migrated to the current block format
+            blockchain, report = import_blocks(LEGACY_PATH, self.store)
+            report.log(self.logger)
+            if not report.valid:
+                # starting from the valid prefix or a new chain would drop the
+                # rest of the stored chain, the file is left for the user to move
+                self.store.truncate(0)
+                self.store.close()
+                self.logger.error(
+                    f"{LEGACY_PATH} could not be imported, move it away to start "
+                    "a new blockchain"
+                )
+                raise report.error
+        if blockchain is not None:
+            self.blockchain = blockchain
+            self.logger.info(f"Blockchain loaded, {len(blockchain.chain)} valid blocks")
+        else:
             # if it doesn't, create a new blockchain
             self.blockchain = Blockchain.generate()
             self.logger.info(
                 "Blockchain was not found or was empty, a new one was generated"
             )
+        self.blockchain.attach(self.store)
+        self.blockchain.snapshots = self.snapshots
+        self.blockchain.retention = self.prune_depth
         self.logger.info("Loading wallet")
         # check if the file key.pem exists in data folder
         notfound = True
@@ -104,9 +147,10 @@ class Daemon:
 
     def save(self):
         """Saves the blockchain and the wallet"""
-        self.logger.info("Saving blockchain")
-        with open("data/blockchain.json", "w") as f:
-            json.dump(self.blockchain.to_dict(), f)
+        # the blocks are written to the store as they are added, the snapshot at
+        # the tip spares the replay on the next start
+        self.snapshots.save(self.blockchain.snapshot())
+        self.store.close()
         self.logger.info("Saving wallet")
         with open("data/key.pem", "wb") as f:
             f.write(self.wallet.private_key.to_pem())
@@ -122,38 +166,104 @@ class Daemon:
         """
         return self.get_balance(self.wallet.public_key)
 
-    def get_balance(self, public_key: str) -> float:
+    def get_balance(self, public_key: bytes) -> int:
         """
         Retrurns the balance of the wallet from the public key of the user wallet
 
         Arguments
         ---------
-        public_key : str
+        public_key : bytes
             The public key of the user wallet
 
         Returns
         -------
-        float
+        int
             The balance of the wallet
         """
-        balance = 0
-        for height, block in self.blockchain.chain.items():
-            for transaction in block.transactions:
-                if transaction.sender == public_key:
-                    balance -= transaction.amount
-                if transaction.recipient == public_key:
-                    balance += transaction.amount
-        return balance
+        return self.blockchain.balances.get(public_key)
+
+    def get_transaction(self, txid: str) -> Optional[dict]:
+        """
+        Returns a confirmed transaction by id
+
+        Parameters
+        ----------
+        txid : str
+            The hex encoded id of the transaction
+
+        Returns
+        -------
+        Optional[dict]
+            The transaction, the height of its block, its position in the block and
+            its number of confirmations, None if the transaction is not in the chain
+        """
+        with self.blockchain.lock:
+            found = self.blockchain.get_transaction(from_hex(txid))
+            if found is None:
+                return None
+            transaction, height, position = found
+            return {
+                "transaction": transaction.to_dict(include_signature=True),
+                "height": height,
+                "position": position,
+                "confirmations": self.blockchain.height - height + 1,
+            }
+
+    def get_chain(self) -> dict:
+        """
+        Returns every block of the chain
 
-    def send(self, recipient: str, amount: float) -> bool:
+        Returns
+        -------
+        dict
+            The blocks by height, only the header of a pruned block is returned
+        """
+        chain = {}
+        with self.blockchain.lock:
+            for height, block in enumerate(self.blockchain.chain):
+                try:
+                    chain[str(height)] = block.to_dict()
+                except PrunedBlockError:
+                    chain[str(height)] = {"header": bytes(block.header).hex()}
+        return chain
+
+    def get_block(self, hash: str) -> Optional[dict]:
+        """
+        Returns a block of the chain by hash
+
+        Parameters
+        ----------
+        hash : str
+            The hex encoded hash of the block
+
+        Returns
+        -------
+        Optional[dict]
+            The block, its height and its number of confirmations, None if the block
+            is not in the chain or its body was pruned
+        """
+        with self.blockchain.lock:
+            height = self.blockchain.chain.height_of(from_hex(hash))
+            if height is None:
+                return None
+            store = self.blockchain.store
+            if store is not None and height < store.pruned:
+                return None
+            return {
+                "block": self.blockchain.chain[height].to_dict(),
+                "height": height,
+                "confirmations": self.blockchain.height - height + 1,
+            }
+
+    def send(self, recipient: str, amount: int) -> bool:
         """
         Sends a transaction to the recipient
 
         Parameters
         ----------
         recipient : str
-            The recipient of the transaction
-        amount : float
+            The hex encoded public key of the recipient
+        amount : int
             The amount of the transaction
 
         Returns
@@ -164,53 +274,67 @@ class Daemon:
         if self.balance() < amount:
             self.logger.info("Not enough balance")
             return False
+        try:
+            recipient = from_hex(recipient)
+        except ValueError:
+            self.logger.info("Invalid recipient")
+            return False
         transaction = Transaction()
         transaction.sender = self.wallet.public_key
         transaction.recipient = recipient
         transaction.amount = amount
-        transaction.timestamp = datetime.now().timestamp()
+        transaction.timestamp = now()
         transaction.sign(self.wallet.private_key)
-        self.blockchain.add_transaction(transaction)
+        if not self.blockchain.add_transaction(transaction):
+            self.logger.info("Transaction rejected")
+            return False
         self.logger.info("Transaction sent")
         return True
 
-    def create_block(self) -> Block:
+    def create_block(self, transactions: list[Transaction]) -> Block:
         """
         Creates a new block
 
+        Parameters
+        ----------
+        transactions : list[Transaction]
+            The transactions of the block, without the reward
+
         Returns
         -------
         Block
             The new block created
         """
-        block = Block.create(
-            self.blockchain.last_block.hash,
-            self.wallet.public_key,
-            self.calculate_difficulty(),
-            self.blockchain.height + 1,
-            self.blockchain.ether,
-        )
-        self.blockchain.ether = Queue()
-        return block
+        with self.blockchain.lock:
+            block = Block.create(
+                self.blockchain.last_block.hash,
+                self.wallet.public_key,
+                self.calculate_difficulty(),
+                self.blockchain.height + 1,
+                transactions,
+            )
+            return block
 
-    def blockfound(self, height: int) -> bool:
+    def select_transactions(self) -> list[Transaction]:
         """
-        Checks if another peer has found the block
-
-        Parameters
-        ----------
-        height : int
-            The height of the block
+        Selects the transactions of the next block in a single pass over the best
+        pending transactions, invalid ones are dropped from the ether
 
         Returns
         -------
-        bool
-            True if the block was found, False otherwise
+        list[Transaction]
+            The valid transactions, no sender spends more than its balance in total
         """
-        if self.blockchain.height == height:
-            return True
-        else:
-            return False
+        with self.blockchain.lock:
+            candidates = self.blockchain.ether.select(MAX_BLOCK_TRANSACTIONS - 1)
+            ledger = SpendLedger(self.blockchain.balances)
+            transactions = []
+            for transaction, signed in zip(candidates, verify_batch(candidates)):
+                if signed and ledger.spend(transaction):
+                    transactions.append(transaction)
+                else:
+                    self.blockchain.ether.remove(transaction.txid)
+            return transactions
 
     def mine(self) -> bool:
         """
@@ -221,47 +345,27 @@ class Daemon:
         bool
             True if the block was mined, False otherwise
         """
-        block = self.create_block()
-        for transaction in block.transactions:
-            if not self.validate_transaction(transaction):
-                block.transactions.remove(transaction)
-        if len(block.transactions) == 0:
+        self.blockchain.new_block.clear()
+        transactions = self.select_transactions()
+        if len(transactions) == 0:
             self.logger.info("No transactions to mine")
             return False
-        nonce = block.proof_of_work(lambda: self.blockfound(block.header.height))
-        if nonce:
-            block = self.reward(block, self.wallet.public_key)
+        block = self.create_block(transactions)
+        # leave room for the reward, which the merkle root has to cover
+        block.transactions = Array(Transaction, len(transactions) + 1, transactions)
+        block = self.reward(block, self.wallet.public_key)
+        block.update_merkle_root()
+        nonce = self.miner.proof_of_work(block, self.blockchain.new_block)
+        # a block from a peer may have moved the tip since the template was built
+        if nonce and self.peer.tree.add(block):
             prot = preset_protocols["new-block"]
             prot.data = block.to_dict()
             self.peer.broadcast(prot)
-            self.blockchain.add_block(block)
             return True
         else:
             return False
 
-    def validate_transaction(self, transaction: Transaction) -> bool:
-        """
-        Validates a transaction
-
-        Parameters
-        ----------
-        transaction : Transaction
-            The transaction to validate
-
-        Returns
-        -------
-        bool
-            True if the transaction is valid, False otherwise
-        """
-        if transaction.amount < 0:
-            return False
-        if transaction.amount > self.get_balance(transaction.sender):
-            return False
-        if not transaction.verify():
-            return False
-        return True
-
-    def reward(self, block: Block, miner_address: str) -> Block:
+    def reward(self, block: Block, miner_address: bytes) -> Block:
         """
         Rewards the miner with coins
 
@@ -269,7 +373,7 @@ class Daemon:
         ----------
         block : Block
             The block to reward
-        miner_address : str
+        miner_address : bytes
             The address of the miner
 
         Returns
@@ -278,37 +382,46 @@ class Daemon:
             The block with the coins rewarded
         """
         reward_tsx = Transaction()
-        reward_tsx.sender = "0"
+        reward_tsx.sender = REWARD_SENDER
         reward_tsx.recipient = miner_address
         reward_tsx.amount = self.blockchain.calc_reward()
-        reward_tsx.timestamp = datetime.now().timestamp()
-        reward_tsx.signature = ""
-        block.transactions.insert(0, reward_tsx)
+        reward_tsx.timestamp = now()
+        reward_tsx.signature = b""
+        block.transactions.insert(reward_tsx, 0)
         return block
 
-    def wallet_history(self) -> list:
+    def wallet_history(self, page: int = 0, page_size: int = 50) -> list:
         """
-        Returns all the transactions associated with this wallet
+        Returns one page of the transactions associated with this wallet, newest first
+
+        Parameters
+        ----------
+        page : int
+            The number of the page, 0 is the newest
+        page_size : int
+            The number of transactions per page
 
         Returns
         -------
         list
-            A list of all the transactions associated with this wallet
-        """
-        transactions = []
-        for height, block in self.blockchain.chain.items():
-            for transaction in block.transactions:
-                tsx = [
-                    transaction.sender,
-                    transaction.recipient,
-                    transaction.amount,
-                    transaction.timestamp,
-                ]
-                if transaction.sender == self.wallet.public_key:
-                    transactions.append(tsx)
-                if transaction.recipient == self.wallet.public_key:
-                    transactions.append(tsx)
-        return transactions
+            A list of the transactions of the page
+        """
+        with self.blockchain.lock:
+            transactions = []
+            for height, position in self.blockchain.addresses.page(
+                self.wallet.public_key, page, page_size
+            ):
+                transaction = self.blockchain.chain[height].transactions[position]
+                data = transaction.to_dict()
+                transactions.append(
+                    [
+                        data["sender"],
+                        data["recipient"],
+                        data["amount"],
+                        data["timestamp"],
+                    ]
+                )
+            return transactions
 
     def start_mining(self, js_logger: callable, enbl_btn: callable) -> None:
         """
@@ -345,6 +458,38 @@ class Daemon:
         self.mining_thread.join()
         enbl_btn(False)
 
+    def mining_stats(self) -> dict:
+        """
+        Returns the live mining telemetry
+
+        Returns
+        -------
+        dict
+            The hashrate of every worker and in total, the attempts and time spent on
+            the current block, the attempts and time of the last mined block, the
+            mined and aborted block counts, the stale attempts and the difficulty
+        """
+        stats = self.miner.stats
+        data = asdict(stats)
+        data["hashrate"] = stats.hashrate
+        return data
+
+    def key_cache_stats(self) -> dict:
+        """
+        Returns the counters of the parsed public key cache
+
+        Returns
+        -------
+        dict
+            The hits and misses of the cache in this process and the verification
+            workers, and the number of keys cached in this process
+        """
+        return {
+            "hits": public_keys.hits,
+            "misses": public_keys.misses,
+            "keys": len(public_keys.keys),
+        }
+
     def mineloop(self, isrunning: callable, js_logger: callable) -> None:
         """
         The mining loop
@@ -360,7 +505,11 @@ class Daemon:
             self.update_blockchain()
             if self.blockchain.block_reached:
                 if self.mine():
-                    js_logger("Block mined")
+                    stats = self.miner.stats
+                    js_logger(
+                        f"Block mined in {stats.last_block_time:.2f} seconds "
+                        f"after {stats.last_attempts} attempts"
+                    )
             else:
                 x = 5  # DEV increase time
                 js_logger(
@@ -375,15 +524,26 @@ class Daemon:
         Returns
         -------
         int
-            The mining difficulty
+            The compact target the next block has to meet
         """
-        if self.blockchain.height % 10 == 0 or self.blockchain.height == 0:
-            return (
-                round(len(self.peer.peers) / 100) if len(self.peer.peers) > 100 else 1
-            )
-        else:
-            return self.blockchain.last_block.header.difficulty
+        return self.blockchain.next_difficulty()
 
     def update_blockchain(self) -> None:
         """Updates the blockchain with the latest blocks from the network"""
-        self.peer.get_longest_chain(self.blockchain.get_chaininfo())
+        chain = self.peer.get_longest_chain(self.blockchain.get_chaininfo())
+        if isinstance(chain, dict):
+            # the known blocks are skipped and the others go through the block tree,
+            # so only the blocks after the fork point are undone and applied
+            tip = self.blockchain.last_block.hash
+            for data in chain.values():
+                try:
+                    block = Block.from_json(data)
+                except (KeyError, TypeError, ValueError) as e:
+                    self.logger.error(f"A synced block could not be decoded ({e!r})")
+                    break
+                if block.hash not in self.peer.tree:
+                    self.peer.tree.add(block)
+            if self.blockchain.last_block.hash != tip:
+                self.logger.info(
+                    f"Blockchain synced to height {self.blockchain.height}"
+                )
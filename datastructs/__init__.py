@@ -1,4 +1,5 @@
 from .queue import Queue
 from .array import Array
+from .lru import LRUCache
 
-__all__ = ["Queue", "Array"]
+__all__ = ["Queue", "Array", "LRUCache"]
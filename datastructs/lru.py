@@ -0,0 +1,67 @@
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class LRUCache:
+    """
+    Bounded cache that evicts the least recently used entry when full
+
+    Args:
+        maxsize (:obj:`int`): the maximum number of entries. Defaults to 1024.
+    """
+
+    def __init__(self, maxsize: int = 1024) -> None:
+        if not isinstance(maxsize, int):
+            raise TypeError("Cache size must be an integer")
+        if maxsize <= 0:
+            raise ValueError("Cache size must be greater than 0")
+        self.maxsize: int = maxsize
+        self.hits: int = 0
+        self.misses: int = 0
+        self._items: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        """
+        Returns the number of entries in the cache.
+        """
+        return len(self._items)
+
+    def __contains__(self, key: Hashable) -> bool:
+        """
+        Returns whether the key is cached, without counting a hit or a miss.
+        """
+        return key in self._items
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Returns the value cached for the key and marks it as recently used.
+        """
+        if key not in self._items:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._items.move_to_end(key)
+        return self._items[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """
+        Caches the value for the key, evicting the least recently used entry if full.
+        """
+        self._items[key] = value
+        self._items.move_to_end(key)
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Removes and returns the value cached for the key.
+        """
+        return self._items.pop(key, default)
+
+    def clear(self) -> None:
+        """
+        Removes every entry and resets the counters.
+        """
+        self._items.clear()
+        self.hits = 0
+        self.misses = 0
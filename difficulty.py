@@ -0,0 +1,112 @@
+MAX_TARGET = (1 << 252) - 1
+TARGET_BLOCK_TIME = 60
+RETARGET_WINDOW = 10
+MAX_ADJUSTMENT = 4
+# how far ahead of the local clock a block timestamp may be, in seconds
+MAX_FUTURE_TIME = 2 * 60 * 60
+
+
+def bits_to_target(bits: int) -> int:
+    """
+    Expands the compact encoding of a target
+
+    Parameters
+    ----------
+    bits : int
+        The compact target, one exponent byte followed by a 3 byte mantissa
+
+    Returns
+    -------
+    int
+        The 256-bit target
+    """
+    exponent = bits >> 24
+    mantissa = bits & 0x7FFFFF
+    if exponent <= 3:
+        return mantissa >> (8 * (3 - exponent))
+    return mantissa << (8 * (exponent - 3))
+
+
+def target_to_bits(target: int) -> int:
+    """
+    Compresses a target to its compact encoding, the target is rounded down
+
+    Parameters
+    ----------
+    target : int
+        The 256-bit target
+
+    Returns
+    -------
+    int
+        The compact target
+    """
+    size = (target.bit_length() + 7) // 8
+    if size <= 3:
+        mantissa = target << (8 * (3 - size))
+    else:
+        mantissa = target >> (8 * (size - 3))
+    if mantissa & 0x800000:
+        # the sign bit of the mantissa must stay clear
+        mantissa >>= 8
+        size += 1
+    return (size << 24) | mantissa
+
+
+MAX_BITS = target_to_bits(MAX_TARGET)
+
+
+def work(bits: int) -> int:
+    """
+    Calculates the expected number of hashes needed to meet a target
+
+    Parameters
+    ----------
+    bits : int
+        The compact target
+
+    Returns
+    -------
+    int
+        The work of a block with this target
+    """
+    return (1 << 256) // (bits_to_target(bits) + 1)
+
+
+def retarget(
+    timestamps: list[float],
+    bits: int,
+    height: int,
+    block_time: int = TARGET_BLOCK_TIME,
+) -> int:
+    """
+    Calculates the target of the next block from the timestamps of the last blocks
+
+    The target only changes at the first block of every RETARGET_WINDOW, it is
+    scaled by the ratio between the time the last window actually took and the
+    configured block time. The ratio is clamped to MAX_ADJUSTMENT either way, so
+    the target never changes by more than MAX_ADJUSTMENT within a window.
+
+    Parameters
+    ----------
+    timestamps : list[float]
+        The timestamps of the last blocks, oldest first
+    bits : int
+        The compact target of the last block
+    height : int
+        The height of the next block
+    block_time : int
+        The number of seconds a block should take
+
+    Returns
+    -------
+    int
+        The compact target of the next block
+    """
+    if height % RETARGET_WINDOW != 0 or len(timestamps) < 2:
+        return bits
+    expected = block_time * (len(timestamps) - 1)
+    actual = timestamps[-1] - timestamps[0]
+    actual = min(max(actual, expected / MAX_ADJUSTMENT), expected * MAX_ADJUSTMENT)
+    target = bits_to_target(bits) * round(actual * 1000) // (expected * 1000)
+    return target_to_bits(min(max(target, 1), MAX_TARGET))
@@ -0,0 +1,320 @@
+from bisect import bisect_left
+
+from block import Block
+from transaction import REWARD_SENDER, Transaction, from_hex, to_hex
+
+
+class BalanceIndex:
+    """
+    The balance of every address, maintained as blocks are applied and undone.
+
+    Attributes
+    ----------
+    balances : dict[bytes, int]
+        The balance of every address that took part in a transaction
+    """
+
+    def __init__(self) -> None:
+        self.balances: dict[bytes, int] = {}
+
+    @classmethod
+    def from_json(cls, json_data: dict) -> "BalanceIndex":
+        """Creates the index from its dict."""
+        index = cls()
+        index.balances = {
+            from_hex(address): balance for address, balance in json_data.items()
+        }
+        return index
+
+    def to_dict(self) -> dict:
+        """Returns the index as a dict."""
+        return {to_hex(address): balance for address, balance in self.balances.items()}
+
+    def get(self, address: bytes) -> int:
+        """
+        Get the balance of an address
+
+        Parameters
+        ----------
+        address : bytes
+            The public key of the wallet
+
+        Returns
+        -------
+        int
+            The balance of the address
+        """
+        return self.balances.get(address, 0)
+
+    def apply_block(self, block: Block) -> dict[bytes, int]:
+        """
+        Apply the transactions of a block to the balances
+
+        Parameters
+        ----------
+        block : Block
+            The block to apply
+
+        Returns
+        -------
+        dict[bytes, int]
+            The undo data, the balance every touched address had before the block
+        """
+        undo = {}
+        for transaction in block.transactions:
+            for address, amount in (
+                (transaction.sender, -transaction.amount),
+                (transaction.recipient, transaction.amount),
+            ):
+                if address not in undo:
+                    undo[address] = self.balances.get(address)
+                self.balances[address] = self.balances.get(address, 0) + amount
+        return undo
+
+    def undo_block(self, undo: dict[bytes, int]) -> None:
+        """
+        Restore the balances from before a block was applied
+
+        Parameters
+        ----------
+        undo : dict[bytes, int]
+            The undo data returned when the block was applied
+        """
+        for address, balance in undo.items():
+            if balance is None:
+                self.balances.pop(address, None)
+            else:
+                self.balances[address] = balance
+
+
+class SpendLedger:
+    """
+    The spendable balance of every sender while a block is assembled, the confirmed
+    balance minus what the sender already spends in the block.
+
+    Attributes
+    ----------
+    balances : BalanceIndex
+        The confirmed balances
+    spent : dict[bytes, int]
+        The amount every sender spends in the block so far
+    """
+
+    def __init__(self, balances: BalanceIndex) -> None:
+        self.balances: BalanceIndex = balances
+        self.spent: dict[bytes, int] = {}
+
+    def available(self, address: bytes) -> int:
+        """Returns the balance an address can still spend in the block."""
+        return self.balances.get(address) - self.spent.get(address, 0)
+
+    def spend(self, transaction: Transaction) -> bool:
+        """
+        Take a transaction into the block if its sender can afford it
+
+        Parameters
+        ----------
+        transaction : Transaction
+            The transaction to take
+
+        Returns
+        -------
+        bool
+            True if the transaction was taken, False if it is invalid or overspends
+        """
+        if transaction.sender == REWARD_SENDER or transaction.amount < 0:
+            return False
+        if transaction.amount > self.available(transaction.sender):
+            return False
+        self.spent[transaction.sender] = (
+            self.spent.get(transaction.sender, 0) + transaction.amount
+        )
+        return True
+
+
+class AddressIndex:
+    """
+    The position of every transaction of every address, maintained as blocks are
+    applied and undone.
+
+    Attributes
+    ----------
+    locations : dict[bytes, list[tuple[int, int]]]
+        The (block height, transaction position) pairs of every address, oldest first
+    """
+
+    def __init__(self) -> None:
+        self.locations: dict[bytes, list[tuple[int, int]]] = {}
+
+    @classmethod
+    def from_json(cls, json_data: dict) -> "AddressIndex":
+        """Creates the index from its dict."""
+        index = cls()
+        index.locations = {
+            from_hex(address): [tuple(location) for location in locations]
+            for address, locations in json_data.items()
+        }
+        return index
+
+    def to_dict(self) -> dict:
+        """Returns the index as a dict."""
+        return {
+            to_hex(address): list(locations)
+            for address, locations in self.locations.items()
+        }
+
+    def apply_block(self, block: Block, height: int) -> None:
+        """
+        Index the transactions of a block
+
+        Parameters
+        ----------
+        block : Block
+            The block to index
+        height : int
+            The height of the block in the chain
+        """
+        for position, transaction in enumerate(block.transactions):
+            for address in {transaction.sender, transaction.recipient}:
+                self.locations.setdefault(address, []).append((height, position))
+
+    def undo_block(self, block: Block, height: int) -> None:
+        """
+        Remove the transactions of the last indexed block
+
+        Parameters
+        ----------
+        block : Block
+            The block to remove
+        height : int
+            The height of the block in the chain
+        """
+        for transaction in block.transactions:
+            for address in {transaction.sender, transaction.recipient}:
+                locations = self.locations.get(address, [])
+                while locations and locations[-1][0] == height:
+                    locations.pop()
+                if not locations:
+                    self.locations.pop(address, None)
+
+    def prune(self, height: int) -> None:
+        """
+        Forget the transactions of the blocks below a height
+
+        Parameters
+        ----------
+        height : int
+            The height of the first block that is kept
+        """
+        for address in list(self.locations):
+            locations = self.locations[address]
+            cut = bisect_left(locations, (height,))
+            if cut == len(locations):
+                del self.locations[address]
+            elif cut:
+                del locations[:cut]
+
+    def count(self, address: bytes) -> int:
+        """Returns the number of transactions of an address."""
+        return len(self.locations.get(address, []))
+
+    def page(
+        self, address: bytes, page: int = 0, page_size: int = 50
+    ) -> list[tuple[int, int]]:
+        """
+        Get one page of the transactions of an address, newest first
+
+        Parameters
+        ----------
+        address : bytes
+            The public key of the wallet
+        page : int
+            The number of the page, 0 is the newest
+        page_size : int
+            The number of transactions per page
+
+        Returns
+        -------
+        list[tuple[int, int]]
+            The (block height, transaction position) pairs of the page
+        """
+        locations = self.locations.get(address, [])
+        end = len(locations) - page * page_size
+        start = max(0, end - page_size)
+        if end <= 0:
+            return []
+        return locations[start:end][::-1]
+
+
+class TransactionIndex:
+    """
+    The location of every transaction by id, maintained as blocks are applied and
+    undone.
+
+    Attributes
+    ----------
+    locations : dict[bytes, tuple[int, int]]
+        The (block height, transaction position) of every transaction id
+    """
+
+    def __init__(self) -> None:
+        self.locations: dict[bytes, tuple[int, int]] = {}
+
+    @classmethod
+    def from_json(cls, json_data: dict) -> "TransactionIndex":
+        """Creates the index from its dict."""
+        index = cls()
+        index.locations = {
+            bytes.fromhex(txid): tuple(location) for txid, location in json_data.items()
+        }
+        return index
+
+    def to_dict(self) -> dict:
+        """Returns the index as a dict."""
+        return {txid.hex(): location for txid, location in self.locations.items()}
+
+    def __contains__(self, txid: bytes) -> bool:
+        """Returns True if the transaction is in the chain."""
+        return txid in self.locations
+
+    def get(self, txid: bytes) -> tuple[int, int]:
+        """
+        Get the location of a transaction
+
+        Parameters
+        ----------
+        txid : bytes
+            The id of the transaction
+
+        Returns
+        -------
+        tuple[int, int]
+            The block height and the position in the block, None if not found
+        """
+        return self.locations.get(txid)
+
+    def apply_block(self, block: Block, height: int) -> None:
+        """
+        Index the transactions of a block
+
+        Parameters
+        ----------
+        block : Block
+            The block to index
+        height : int
+            The height of the block in the chain
+        """
+        for position, transaction in enumerate(block.transactions):
+            self.locations[transaction.txid] = (height, position)
+
+    def undo_block(self, block: Block) -> None:
+        """
+        Remove the transactions of a block
+
+        Parameters
+        ----------
+        block : Block
+            The block to remove
+        """
+        for transaction in block.transactions:
+            self.locations.pop(transaction.txid, None)
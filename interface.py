@@ -6,8 +6,9 @@ import json
 import eel
 from config import logger
 
-daemon = Daemon(logger)
-daemon.start()
+# started in the main block, so worker processes importing this module under the
+# spawn start method do not start a second daemon and window
+daemon: Daemon = None
 
 
 @eel.expose
@@ -17,15 +18,15 @@ def get_balance():
 
 
 @eel.expose
-def get_history():
-    """Gets the history of the wallet"""
-    return daemon.wallet_history()
+def get_history(page=0):
+    """Gets a page of the history of the wallet"""
+    return daemon.wallet_history(int(page))
 
 
 @eel.expose
 def get_chain():
     """Get the chain of the blockchain"""
-    return json.dumps(daemon.blockchain.to_dict())
+    return json.dumps(daemon.get_chain())
 
 
 @eel.expose
@@ -43,11 +44,26 @@ def mine(state):
         daemon.stop_mining(eel.logger, eel.enable_mining_button)
 
 
+@eel.expose
+def get_mining_stats():
+    """Get the mining telemetry"""
+    return daemon.mining_stats()
+
+
+@eel.expose
+def get_key_cache_stats():
+    """Get the counters of the public key cache"""
+    return daemon.key_cache_stats()
+
+
 def close():
     """Close the daemon"""
     daemon.stop()
     exit()
 
 
-eel.init("web")
-eel.start("index.html", size=(None, None), close_callback=lambda *args: close())
+if __name__ == "__main__":
+    daemon = Daemon(logger)
+    daemon.start()
+    eel.init("web")
+    eel.start("index.html", size=(None, None), close_callback=lambda *args: close())
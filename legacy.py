@@ -0,0 +1,288 @@
+import time
+from itertools import chain
+from json import JSONDecodeError, JSONDecoder
+from typing import Iterator, TextIO
+
+from ecdsa.errors import MalformedPointError
+from ecdsa.util import MalformedSignature, sigdecode_string
+
+from block import ADDRESS_SIZE, NULL_HASH, Block, pack_hex
+from blockchain import Blockchain
+from difficulty import MAX_BITS, RETARGET_WINDOW, retarget
+from store import BlockStore
+from transaction import (
+    TIMESTAMP_SCALE,
+    Transaction,
+    public_keys,
+    sigencode_low_s,
+    to_timestamp,
+)
+from validation import ChainValidator, ValidationError, ValidationReport
+from verification import verify_batch
+
+LEGACY_PATH = "data/blockchain.json"
+CHUNK_SIZE = 64 * 1024
+WHITESPACE = " \t\n\r"
+
+
+class LegacyReader:
+    """
+    Reads the blocks of a blockchain.json file one at a time. Only the block being
+    decoded is held in the buffer, so the memory used does not grow with the file.
+
+    Attributes
+    ----------
+    file : TextIO
+        The open blockchain.json file
+    chunk_size : int
+        The number of characters read at once
+    """
+
+    def __init__(self, file: TextIO, chunk_size: int = CHUNK_SIZE) -> None:
+        self.file: TextIO = file
+        self.chunk_size: int = chunk_size
+        self.buffer: str = ""
+        self.position: int = 0
+        self.eof: bool = False
+        self.decoder = JSONDecoder()
+
+    def fill(self) -> bool:
+        """Drops the consumed text and reads more, returns False at the end of file."""
+        if self.eof:
+            return False
+        self.buffer = self.buffer[self.position :]
+        self.position = 0
+        # read at least as much as is buffered, a large block takes log(n) reads
+        data = self.file.read(max(self.chunk_size, len(self.buffer)))
+        self.eof = not data
+        self.buffer += data
+        return not self.eof
+
+    def peek(self) -> str:
+        """Returns the next character that is not whitespace, "" at the end of file."""
+        while True:
+            while self.position < len(self.buffer):
+                if self.buffer[self.position] not in WHITESPACE:
+                    return self.buffer[self.position]
+                self.position += 1
+            if not self.fill():
+                return ""
+
+    def expect(self, character: str) -> None:
+        """Consumes the next character, which has to be the given one."""
+        found = self.peek()
+        if found != character:
+            raise ValueError(
+                f"Expected {character!r} at {self.position}, found {found!r}"
+            )
+        self.position += 1
+
+    def value(self):
+        """Decodes the next json value, reading until it is complete."""
+        self.peek()
+        while True:
+            try:
+                value, self.position = self.decoder.raw_decode(
+                    self.buffer, self.position
+                )
+                return value
+            except JSONDecodeError:
+                if not self.fill():
+                    raise
+
+    def __iter__(self) -> Iterator[tuple[str, dict]]:
+        """Yields the key and json dict of every block, in file order."""
+        if self.peek() == "":
+            return
+        self.expect("{")
+        if self.peek() == "}":
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key, self.value()
+            if self.peek() == "}":
+                return
+            self.expect(",")
+
+
+def read_blocks(
+    path: str = LEGACY_PATH, chunk_size: int = CHUNK_SIZE
+) -> Iterator[tuple[str, dict]]:
+    """
+    Stream the blocks of a legacy blockchain.json file
+
+    Parameters
+    ----------
+    path : str
+        The path of the file
+    chunk_size : int
+        The number of characters read at once
+
+    Returns
+    -------
+    Iterator[tuple[str, dict]]
+        The key and json dict of every block, in chain order
+    """
+    with open(path, "r") as f:
+        yield from LegacyReader(f, chunk_size)
+
+
+def is_baseline(json_data: dict) -> bool:
+    """Returns True if the baseline wrote the block, with every header field apart."""
+    return "header" not in json_data
+
+
+class BaselineMigrator(ChainValidator):
+    """
+    Imports a blockchain.json file written by the baseline. Its blocks are stored
+    under keys counted from 1, with every header field separately, a leading-zero
+    difficulty and the hash of a pickle of the header, which cannot be reproduced.
+    Every block is checked against the stored chain it came from, then re-encoded
+    with the current header on top of the blocks migrated so far and mined again
+    at the current difficulty. The migrated blocks go through every stage of the
+    chain validation, so the balances and the stored signatures are checked.
+
+    This is a trust-on-import path, the old proof of work cannot be verified and
+    the baseline did not sign its transactions. Only a file the user already
+    trusts should be migrated.
+
+    Attributes
+    ----------
+    legacy_hash : str
+        The stored hash of the last baseline block, the next one has to link to it
+    tip_hash : bytes
+        The hash of the last migrated block
+    tip_bits : int
+        The compact target of the next migrated block
+    tip_timestamps : list[float]
+        The timestamps of the last migrated blocks in seconds
+    """
+
+    def reset(self, store: BlockStore = None) -> None:
+        """Starts a new migration, the migrated blocks are written to the store."""
+        super().reset(store)
+        self.legacy_hash: str = "0"
+        self.tip_hash: bytes = NULL_HASH
+        self.tip_bits: int = MAX_BITS
+        self.tip_timestamps: list[float] = []
+
+    def decode(self, items: list[tuple[str, dict]], start: int) -> list[Block]:
+        """Stage 1, checks and re-encodes the baseline blocks in chain order."""
+        started = time.perf_counter()
+        blocks = []
+        for height, (key, json_data) in enumerate(items, start=start):
+            if key != str(height + 1):
+                self.fail(height, f"stored under key {key}")
+                break
+            try:
+                blocks.append(self.convert(json_data, height))
+            except (KeyError, TypeError, ValueError) as e:
+                self.fail(height, f"could not be migrated ({e})")
+                break
+        self.record("decode", len(blocks), started)
+        return blocks
+
+    def convert(self, json_data: dict, height: int) -> Block:
+        """
+        Re-encodes a baseline block on top of the blocks migrated so far
+
+        Parameters
+        ----------
+        json_data : dict
+            The baseline block
+        height : int
+            The height of the block, the stored height is not trusted
+
+        Returns
+        -------
+        Block
+            The block with the current header, mined again
+
+        Raises
+        ------
+        ValueError
+            If the block does not link to the stored chain, its hash does not meet
+            its difficulty or a signature is malformed
+        """
+        hash, difficulty = json_data["hash"], json_data["difficulty"]
+        if json_data["previous_hash"] != self.legacy_hash:
+            raise ValueError("does not link to the previous block")
+        elif not isinstance(difficulty, int) or difficulty < 0:
+            raise ValueError(f"has difficulty {difficulty!r}")
+        elif not hash.startswith("0" * difficulty):
+            raise ValueError("hash does not meet its leading-zero difficulty")
+        transactions = [Transaction.from_json(t) for t in json_data["transactions"]]
+        for transaction in transactions:
+            if transaction.signature is not None:
+                self.normalize(transaction)
+        block = Block.create(
+            self.tip_hash,
+            pack_hex(json_data["miner_address"], ADDRESS_SIZE),
+            self.tip_bits,
+            height,
+            transactions,
+        )
+        block.header.timestamp = to_timestamp(json_data["timestamp"])
+        block.proof_of_work()
+        self.legacy_hash = hash
+        self.tip_hash = block.hash
+        self.tip_timestamps.append(block.header.timestamp / TIMESTAMP_SCALE)
+        self.tip_timestamps = self.tip_timestamps[-RETARGET_WINDOW:]
+        self.tip_bits = retarget(self.tip_timestamps, self.tip_bits, height + 1)
+        return block
+
+    @staticmethod
+    def normalize(transaction: Transaction) -> None:
+        """Replaces the signature by its low s twin, the baseline kept either one."""
+        try:
+            order = public_keys.get(transaction.sender).curve.order
+            r, s = sigdecode_string(transaction.signature, order)
+        except (MalformedPointError, MalformedSignature) as e:
+            raise ValueError(f"has a malformed signature ({e})") from e
+        transaction.signature = sigencode_low_s(r, s, order)
+
+    def check_signatures(self, blocks: list[Block], start: int) -> None:
+        """Stage 4, verifies the stored signatures, unsigned transfers are trusted."""
+        started = time.perf_counter()
+        transactions = []
+        heights = []
+        for height, block in enumerate(blocks, start=start):
+            for transaction in block.transactions:
+                if transaction.signature is not None:
+                    transactions.append(transaction)
+                    heights.append(height)
+        for height, valid in zip(heights, verify_batch(transactions)):
+            if not valid:
+                self.fail(height, "has an invalid signature")
+        self.record("signatures", len(transactions), started)
+
+
+def import_blocks(
+    path: str = LEGACY_PATH, store: BlockStore = None
+) -> tuple[Blockchain, ValidationReport]:
+    """
+    Validates a blockchain.json file, or migrates it if the baseline wrote it
+
+    Parameters
+    ----------
+    path : str
+        The path of the file
+    store : BlockStore
+        An empty store the valid blocks are written to, None to keep them in memory
+
+    Returns
+    -------
+    tuple[Blockchain, ValidationReport]
+        The blockchain of the valid blocks, None if there is none, and the report
+    """
+    items = read_blocks(path)
+    try:
+        first = next(items, None)
+    except ValueError as e:
+        error = ValidationError(0, f"could not be read ({e!r})")
+        return None, ValidationReport(error=error)
+    if first is None:
+        return None, ValidationReport()
+    validator = BaselineMigrator() if is_baseline(first[1]) else ChainValidator()
+    return validator.validate_stream(chain([first], items), store)
@@ -0,0 +1,192 @@
+import heapq
+from itertools import count
+from typing import Iterator
+
+from transaction import Transaction
+
+MAX_TRANSACTIONS = 50000
+MAX_BYTES = 32 * 1024 * 1024
+
+
+class Mempool:
+    """
+    The pending transactions, indexed by id and by sender and bounded in count and
+    in bytes. When a cap is exceeded the transactions with the lowest priority are
+    evicted, which may be the incoming one.
+
+    Attributes
+    ----------
+    entries : dict[bytes, Transaction]
+        The pending transactions by id
+    senders : dict[bytes, dict[bytes, Transaction]]
+        The pending transactions of every sender by id
+    max_transactions : int
+        The maximum number of pending transactions
+    max_bytes : int
+        The maximum total size of the pending transactions
+    priority : callable
+        Returns the sort key of a transaction, lower keys are mined first. When None
+        transactions are mined in the order they were added, the timestamp is set
+        by the sender and cannot be trusted
+    size : int
+        The total size of the pending transactions
+    """
+
+    def __init__(
+        self,
+        max_transactions: int = MAX_TRANSACTIONS,
+        max_bytes: int = MAX_BYTES,
+        priority: callable = None,
+    ) -> None:
+        self.entries: dict[bytes, Transaction] = {}
+        self.senders: dict[bytes, dict[bytes, Transaction]] = {}
+        self.max_transactions: int = max_transactions
+        self.max_bytes: int = max_bytes
+        self.priority: callable = priority
+        self.size: int = 0
+        # both heaps hold (key, sequence, txid), removed ids are skipped lazily
+        self._best: list = []
+        self._worst: list = []
+        self._sequence = count()
+
+    def __len__(self) -> int:
+        """Returns the number of pending transactions."""
+        return len(self.entries)
+
+    def __contains__(self, txid: bytes) -> bool:
+        """Returns True if a transaction with this id is pending."""
+        return txid in self.entries
+
+    def __iter__(self) -> Iterator[Transaction]:
+        """Iterates over the pending transactions in arrival order."""
+        return iter(list(self.entries.values()))
+
+    def add(self, transaction: Transaction) -> bool:
+        """
+        Add a transaction to the mempool
+
+        Parameters
+        ----------
+        transaction : Transaction
+            The transaction to add
+
+        Returns
+        -------
+        bool
+            True if the transaction was added, False if it is a duplicate or was
+            evicted right away
+        """
+        txid = transaction.txid
+        if txid in self.entries:
+            return False
+        sequence = next(self._sequence)
+        key = sequence if self.priority is None else self.priority(transaction)
+        self.entries[txid] = transaction
+        self.senders.setdefault(transaction.sender, {})[txid] = transaction
+        self.size += transaction.size
+        heapq.heappush(self._best, (key, sequence, txid))
+        heapq.heappush(self._worst, (-key, -sequence, txid))
+        while len(self.entries) > self.max_transactions or self.size > self.max_bytes:
+            self.evict()
+        self.compact()
+        return txid in self.entries
+
+    def remove(self, txid: bytes) -> Transaction:
+        """
+        Remove a transaction from the mempool
+
+        Parameters
+        ----------
+        txid : bytes
+            The id of the transaction
+
+        Returns
+        -------
+        Transaction
+            The removed transaction, None if it was not pending
+        """
+        transaction = self.entries.pop(txid, None)
+        if transaction is None:
+            return None
+        sender = self.senders[transaction.sender]
+        del sender[txid]
+        if not sender:
+            del self.senders[transaction.sender]
+        self.size -= transaction.size
+        return transaction
+
+    def remove_transactions(self, transactions: Iterator[Transaction]) -> None:
+        """
+        Remove the transactions that were confirmed in a block
+
+        Parameters
+        ----------
+        transactions : Iterator[Transaction]
+            The transactions of the block
+        """
+        for transaction in transactions:
+            self.remove(transaction.txid)
+        self.compact()
+
+    def evict(self) -> Transaction:
+        """
+        Remove the transaction with the lowest priority
+
+        Returns
+        -------
+        Transaction
+            The evicted transaction
+        """
+        while self._worst:
+            _, _, txid = heapq.heappop(self._worst)
+            if txid in self.entries:
+                return self.remove(txid)
+
+    def from_sender(self, sender: bytes) -> list[Transaction]:
+        """
+        Get the pending transactions of a sender
+
+        Parameters
+        ----------
+        sender : bytes
+            The public key of the sender
+
+        Returns
+        -------
+        list[Transaction]
+            The pending transactions of the sender, in arrival order
+        """
+        return list(self.senders.get(sender, {}).values())
+
+    def select(self, limit: int = None) -> list[Transaction]:
+        """
+        Get the transactions for a block template
+
+        Parameters
+        ----------
+        limit : int
+            The maximum number of transactions, all of them if None
+
+        Returns
+        -------
+        list[Transaction]
+            The pending transactions with the highest priority, best first
+        """
+        self.compact()
+        stale = len(self._best) - len(self.entries)
+        wanted = len(self._best) if limit is None else limit + stale
+        selected = {}
+        for _, _, txid in heapq.nsmallest(wanted, self._best):
+            if txid in self.entries:
+                selected.setdefault(txid, self.entries[txid])
+        selected = list(selected.values())
+        return selected if limit is None else selected[:limit]
+
+    def compact(self) -> None:
+        """Drop the removed ids from the heaps once they make up half of them."""
+        for name in ("_best", "_worst"):
+            heap = getattr(self, name)
+            if len(heap) > 2 * len(self.entries) + 64:
+                heap = [entry for entry in heap if entry[2] in self.entries]
+                heapq.heapify(heap)
+                setattr(self, name, heap)
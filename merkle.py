@@ -0,0 +1,92 @@
+from hashlib import sha256
+
+EMPTY_ROOT = bytes(32)
+
+
+def hash_pair(left: bytes, right: bytes) -> bytes:
+    """Returns the hash of two sibling nodes."""
+    return sha256(left + right).digest()
+
+
+def next_level(level: list[bytes]) -> list[bytes]:
+    """Returns the parents of a tree level, the last node is paired with itself."""
+    if len(level) % 2:
+        level = level + [level[-1]]
+    return [hash_pair(level[i], level[i + 1]) for i in range(0, len(level), 2)]
+
+
+def merkle_root(txids: list[bytes]) -> bytes:
+    """
+    Calculate the merkle root of a list of transaction ids
+
+    Parameters
+    ----------
+    txids : list[bytes]
+        The ids of the transactions, in block order
+
+    Returns
+    -------
+    bytes
+        The root, zeros for an empty list
+    """
+    if not txids:
+        return EMPTY_ROOT
+    level = list(txids)
+    while len(level) > 1:
+        level = next_level(level)
+    return level[0]
+
+
+def merkle_proof(txids: list[bytes], index: int) -> list[tuple[bytes, bool]]:
+    """
+    Build the inclusion proof of a transaction
+
+    Parameters
+    ----------
+    txids : list[bytes]
+        The ids of the transactions, in block order
+    index : int
+        The position of the transaction in the block
+
+    Returns
+    -------
+    list[tuple[bytes, bool]]
+        The sibling hash of every level from the leaves up, and whether the sibling
+        is on the left
+    """
+    if not 0 <= index < len(txids):
+        raise IndexError(f"Transaction index {index} out of range")
+    proof = []
+    level = list(txids)
+    while len(level) > 1:
+        sibling = index ^ 1
+        if sibling == len(level):
+            sibling = index
+        proof.append((level[sibling], sibling < index))
+        level = next_level(level)
+        index //= 2
+    return proof
+
+
+def verify_proof(txid: bytes, proof: list[tuple[bytes, bool]], root: bytes) -> bool:
+    """
+    Check the inclusion proof of a transaction against a merkle root
+
+    Parameters
+    ----------
+    txid : bytes
+        The id of the transaction
+    proof : list[tuple[bytes, bool]]
+        The proof returned by merkle_proof
+    root : bytes
+        The merkle root of the block header
+
+    Returns
+    -------
+    bool
+        True if the transaction is included under the root
+    """
+    node = txid
+    for sibling, left in proof:
+        node = hash_pair(sibling, node) if left else hash_pair(node, sibling)
+    return node == root
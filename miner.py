@@ -0,0 +1,254 @@
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from multiprocessing import get_all_start_methods, get_context
+from multiprocessing.queues import Queue
+from multiprocessing.sharedctypes import Array
+from multiprocessing.synchronize import Event
+from queue import Empty
+
+from block import Block, BlockHeader, NONCE_LIMIT
+
+
+def search(
+    tasks: Queue, stop: Event, results: Queue, counts: Array, worker: int
+) -> None:
+    """
+    Searches the nonce ranges put on its task queue for a valid proof of work until
+    it gets None, runs inside a worker process of the pool.
+
+    Parameters
+    ----------
+    tasks : Queue
+        The queue of (header, start, end) ranges of this worker.
+    stop : Event
+        Set when the search of the current block should be abandoned.
+    results : Queue
+        The queue every range is answered on, with the winning (nonce, hash) pair
+        or (None, None).
+    counts : Array
+        The shared attempt counters of the workers.
+    worker : int
+        The index of this worker in the counters.
+    """
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        header, start, end = task
+        block = Block(header, [])
+        if block.proof_of_work(
+            stop, start, end, lambda n: counts.__setitem__(worker, n)
+        ):
+            stop.set()
+            results.put((header.nonce, header.hash))
+        else:
+            results.put((None, None))
+
+
+@dataclass
+class MiningStats:
+    """
+    Mining telemetry
+
+    Attributes
+    ----------
+    mining : bool
+        Whether a block is currently being mined.
+    difficulty : int
+        The difficulty of the block being mined, or of the last one.
+    workers : int
+        The number of worker processes.
+    hashrates : list[float]
+        The hashes per second of every worker on the current block.
+    attempts : int
+        The number of nonces tried on the current block.
+    elapsed : float
+        The seconds spent on the current block.
+    last_attempts : int
+        The number of nonces tried on the last mined block.
+    last_block_time : float
+        The seconds it took to mine the last mined block.
+    blocks_mined : int
+        The number of blocks mined by this node.
+    blocks_aborted : int
+        The number of blocks abandoned because a peer found them first.
+    stale_attempts : int
+        The number of nonces tried on abandoned blocks.
+    """
+
+    mining: bool = False
+    difficulty: int = None
+    workers: int = 0
+    hashrates: list[float] = field(default_factory=list)
+    attempts: int = 0
+    elapsed: float = 0
+    last_attempts: int = 0
+    last_block_time: float = None
+    blocks_mined: int = 0
+    blocks_aborted: int = 0
+    stale_attempts: int = 0
+
+    @property
+    def hashrate(self) -> float:
+        """Returns the total hashes per second of all the workers."""
+        return sum(self.hashrates)
+
+
+class Miner:
+    """
+    The proof of work engine, splits the nonce space across a pool of worker
+    processes. The workers are started with the first block and kept for the next
+    ones, they are forked where the platform allows it.
+
+    Attributes
+    ----------
+    workers : int
+        The number of worker processes used to mine a block.
+    poll_interval : float
+        The number of seconds between two checks of the cancel event.
+    processes : list[Process]
+        The worker processes, empty until the first block is mined.
+    """
+
+    def __init__(self, workers: int = None, poll_interval: float = 0.005) -> None:
+        self.workers: int = workers or os.cpu_count() or 1
+        self.poll_interval: float = poll_interval
+        self.counts = [0] * self.workers
+        self.started: float = None
+        self.history = MiningStats(workers=self.workers)
+        self.processes = []
+        self.tasks: list[Queue] = []
+        self.stop: Event = None
+        self.results: Queue = None
+
+    def start(self) -> None:
+        """Starts the worker processes if they are not running."""
+        if self.processes:
+            return
+        method = "fork" if "fork" in get_all_start_methods() else "spawn"
+        context = get_context(method)
+        self.stop = context.Event()
+        self.results = context.Queue()
+        self.counts = context.Array("Q", self.workers, lock=False)
+        self.tasks = [context.Queue() for _ in range(self.workers)]
+        self.processes = [
+            context.Process(
+                target=search,
+                args=(tasks, self.stop, self.results, self.counts, i),
+                daemon=True,
+            )
+            for i, tasks in enumerate(self.tasks)
+        ]
+        for process in self.processes:
+            process.start()
+
+    def close(self, terminate: bool = False) -> None:
+        """Stops the worker processes, killing them if terminate is True."""
+        for tasks, process in zip(self.tasks, self.processes):
+            if terminate:
+                process.terminate()
+            else:
+                tasks.put(None)
+        for process in self.processes:
+            process.join()
+        self.processes = []
+        self.tasks = []
+
+    @property
+    def stats(self) -> MiningStats:
+        """Returns a snapshot of the mining telemetry."""
+        stats = MiningStats(**self.history.__dict__)
+        if self.started is not None:
+            stats.mining = True
+            stats.elapsed = time.time() - self.started
+            stats.attempts = sum(self.counts)
+            stats.hashrates = [
+                count / stats.elapsed if stats.elapsed else 0.0 for count in self.counts
+            ]
+        return stats
+
+    def proof_of_work(self, block: Block, cancel: threading.Event) -> bool:
+        """
+        Mines the block, every worker gets a disjoint range of the nonce space.
+
+        Parameters
+        ----------
+        block : Block
+            The block to mine.
+        cancel : threading.Event
+            Set when the block was found by a peer and mining should stop.
+
+        Returns
+        -------
+        bool
+            True if a valid nonce was found, False if the mining was cancelled
+        """
+        if self.workers == 1:
+            self.counts = [0]
+        else:
+            self.start()
+            for i in range(self.workers):
+                self.counts[i] = 0
+        self.history.difficulty = block.header.difficulty
+        self.started = time.time()
+        found = False
+        try:
+            found = self.search(block, cancel)
+        finally:
+            stats = self.stats
+            self.started = None
+            if found:
+                self.history.blocks_mined += 1
+                self.history.last_attempts = stats.attempts
+                self.history.last_block_time = stats.elapsed
+            else:
+                self.history.blocks_aborted += 1
+                self.history.stale_attempts += stats.attempts
+        return found
+
+    def search(self, block: Block, cancel: threading.Event) -> bool:
+        """
+        Runs the workers until one of them finds a valid nonce or mining is cancelled
+
+        Parameters
+        ----------
+        block : Block
+            The block to mine.
+        cancel : threading.Event
+            Set when the block was found by a peer and mining should stop.
+
+        Returns
+        -------
+        bool
+            True if a valid nonce was found, False if the mining was cancelled
+        """
+        if self.workers == 1:
+            return block.proof_of_work(
+                cancel, progress=lambda n: self.counts.__setitem__(0, n)
+            )
+        self.stop.clear()
+        span = NONCE_LIMIT // self.workers
+        for i, tasks in enumerate(self.tasks):
+            tasks.put((block.header, i * span, (i + 1) * span))
+        found = None
+        # every worker answers its range, so the pool is idle once they all did
+        pending = self.workers
+        while pending:
+            try:
+                nonce, hash = self.results.get(timeout=self.poll_interval)
+            except Empty:
+                if cancel.is_set():
+                    self.stop.set()
+                if not all(process.is_alive() for process in self.processes):
+                    self.close(terminate=True)
+                    break
+                continue
+            pending -= 1
+            if nonce is not None and found is None:
+                found = nonce, hash
+        if found is None:
+            return False
+        block.header.nonce, block.header.hash = found
+        return True
@@ -4,6 +4,11 @@ from dataclasses import dataclass
 from json import loads, dumps
 from typing import Any
 
+from block import Block
+from blocktree import BlockTree
+from store import PrunedBlockError
+from transaction import Transaction
+
 
 @dataclass
 class Protocol:
@@ -46,6 +51,8 @@ preset_protocols = {
     "new-transaction": Protocol(type="new-transaction", data=None),
     "chain-info": Protocol(type="chain-info", data=None),
     "get-chain": Protocol(type="get-chain", data=None),
+    "get-headers": Protocol(type="get-headers", data=None),
+    "get-proof": Protocol(type="get-proof", data=None),
     "get-peers": Protocol(type="get-peers", data=()),
     "get-transactions": Protocol(type="get-transactions", data=None),
     "ack": Protocol(type="ack", data=None),
@@ -74,6 +81,8 @@ class Peer:
         The socket of the peer node.
     blockchain : Blockchain
         The blockchain of the peer node.
+    tree : BlockTree
+        The competing branches of the blockchain.
     """
 
     def __init__(self, blockchain, port: int = 5000, buffer_size: int = 1024) -> None:
@@ -85,6 +94,7 @@ class Peer:
         self.tracker_addr = (self.host, 12345)  # DEV: add real host address
         self.node = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.blockchain = blockchain
+        self.tree = BlockTree(blockchain)
 
     def start(self) -> None:
         """Start the peer node."""
@@ -128,27 +138,53 @@ class Peer:
         if prot.type == "ping":
             conn.send(bytes(preset_protocols["ack"]))
         elif prot.type == "new-block":
-            self.blockchain.add_block(prot.data)
+            # the block extends the main chain or a side branch, or triggers a reorg
+            self.tree.add(Block.from_json(prot.data))
             conn.send(bytes(preset_protocols["ack"]))
         elif prot.type == "new-transaction":
-            self.blockchain.add_transaction(prot.data)
+            self.blockchain.add_transaction(Transaction.from_json(prot.data))
             conn.send(bytes(preset_protocols["ack"]))
         elif prot.type == "chain-info":
             if prot.data:
                 return prot.data, addr
             else:
                 prot = preset_protocols["chain-info"]
-                prot.data = self.blockchain.get_chaininfo()
+                height, hash = self.blockchain.get_chaininfo()
+                prot.data = [height, hash.hex()]
                 conn.send(bytes(prot))
         elif prot.type == "get-chain":
             prot = preset_protocols["get-chain"]
-            prot.data = self.blockchain.to_dict()
+            try:
+                prot.data = self.blockchain.to_dict()
+            except PrunedBlockError:
+                # a pruned node only holds the bodies of the recent blocks
+                prot.data = None
+            conn.send(bytes(prot))
+        elif prot.type == "get-headers":
+            start = prot.data or 0
+            prot = preset_protocols["get-headers"]
+            prot.data = [h.hex() for h in self.blockchain.get_headers(start)]
+            conn.send(bytes(prot))
+        elif prot.type == "get-proof":
+            height, index = prot.data
+            prot = preset_protocols["get-proof"]
+            try:
+                txid, proof, root = self.blockchain.get_merkle_proof(height, index)
+                prot.data = [
+                    txid.hex(),
+                    [[sibling.hex(), left] for sibling, left in proof],
+                    root.hex(),
+                ]
+            except PrunedBlockError:
+                prot.data = None
             conn.send(bytes(prot))
         elif prot.type == "get-peers":
             self.peers = prot.data
         elif prot.type == "get-transactions":
-            prot = preset_protocols["get-trans"]
-            prot.data = self.blockchain.ether
+            prot = preset_protocols["get-transactions"]
+            prot.data = [
+                t.to_dict(include_signature=True) for t in self.blockchain.ether
+            ]
             conn.send(bytes(prot))
 
     def broadcast(self, message: Protocol) -> Any:
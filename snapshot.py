@@ -0,0 +1,96 @@
+import json
+import os
+from json import JSONDecodeError
+
+SNAPSHOTS_DIR = "data/snapshots"
+SNAPSHOT_INTERVAL = 100
+SNAPSHOTS_KEPT = 2
+
+
+class SnapshotStore:
+    """
+    Atomic snapshots of the derived state of the chain, the balances, the undo
+    data and the indexes. Every snapshot is tagged with the height and hash of the
+    block it was taken at, so it is only restored on a chain that holds that block.
+
+    Attributes
+    ----------
+    directory : str
+        The directory of the snapshot files
+    interval : int
+        The number of blocks between two snapshots
+    kept : int
+        The number of snapshots kept, the older ones are deleted
+    """
+
+    def __init__(
+        self,
+        directory: str = SNAPSHOTS_DIR,
+        interval: int = SNAPSHOT_INTERVAL,
+        kept: int = SNAPSHOTS_KEPT,
+    ) -> None:
+        self.directory: str = directory
+        self.interval: int = interval
+        self.kept: int = kept
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, height: int, hash: str) -> str:
+        """Returns the path of the snapshot taken at a block."""
+        return os.path.join(self.directory, f"{height:010d}-{hash}.json")
+
+    def snapshots(self) -> list[tuple[int, str]]:
+        """Returns the height and hash of every snapshot, the newest first."""
+        snapshots = []
+        for name in os.listdir(self.directory):
+            height, _, rest = name.partition("-")
+            if rest.endswith(".json") and height.isdigit():
+                snapshots.append((int(height), rest[: -len(".json")]))
+        return sorted(snapshots, reverse=True)
+
+    def save(self, state: dict) -> None:
+        """
+        Write a snapshot atomically, it replaces nothing until it is fully on disk
+
+        Parameters
+        ----------
+        state : dict
+            The state returned by Blockchain.snapshot
+        """
+        path = self.path(state["height"], state["hash"])
+        temporary = path + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+        directory = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        for height, hash in self.snapshots()[self.kept :]:
+            os.remove(self.path(height, hash))
+
+    def load(self, hashes: list[bytes]) -> dict:
+        """
+        Load the newest snapshot taken at a block of the chain
+
+        Parameters
+        ----------
+        hashes : list[bytes]
+            The hash of every block of the chain, the genesis block first
+
+        Returns
+        -------
+        dict
+            The state of the snapshot, None if no snapshot matches the chain
+        """
+        for height, hash in self.snapshots():
+            if height >= len(hashes) or hashes[height].hex() != hash:
+                continue
+            try:
+                with open(self.path(height, hash), "r") as f:
+                    return json.load(f)
+            except (OSError, JSONDecodeError):
+                continue
+        return None
@@ -0,0 +1,506 @@
+import lzma
+import mmap
+import os
+import zlib
+from struct import Struct
+from typing import Iterator
+
+from block import Block, BlockHeader, HASH_SIZE, HEADER_SIZE
+from datastructs import LRUCache
+
+BLOCKS_DIR = "data/blocks"
+SEGMENT_SIZE = 16 * 1024 * 1024
+BLOCK_CACHE_SIZE = 256
+SEGMENT_CACHE_SIZE = 4
+HOT_SEGMENTS = 1
+# the file extension, compress and decompress functions of every segment codec
+CODECS = {
+    "zlib": (".zz", zlib.compress, zlib.decompress),
+    "lzma": (".xz", lzma.compress, lzma.decompress),
+}
+# every record of a segment is the length of the encoded block followed by the block
+RECORD_PREFIX = Struct(">I")
+# hash, segment, offset of the record, length of the encoded block
+INDEX_ENTRY = Struct(f">{HASH_SIZE}sIQI")
+
+
+class PrunedBlockError(LookupError):
+    """The body of a block was pruned, only its header is kept."""
+
+
+class BlockHandle:
+    """
+    A stored block that is decoded only when it is used. The hash comes from the
+    index, the header is decoded on its own and the full block goes through the
+    decoded block cache of the store.
+
+    Attributes
+    ----------
+    store : BlockStore
+        The store holding the block
+    height : int
+        The height of the block in the store
+    hash : bytes
+        The hash of the block
+    """
+
+    __slots__ = ("store", "height", "hash")
+
+    def __init__(self, store: "BlockStore", height: int, hash: bytes) -> None:
+        self.store: BlockStore = store
+        self.height: int = height
+        self.hash: bytes = hash
+
+    def __bytes__(self) -> bytes:
+        """Returns the encoded block, without decoding it."""
+        return self.store.read(self.height)
+
+    @property
+    def pruned(self) -> bool:
+        """Returns True if only the header of the block is kept."""
+        return self.height < self.store.pruned
+
+    def __getattr__(self, name: str):
+        """Delegates everything else to the decoded block."""
+        return getattr(self.block, name)
+
+    @property
+    def block(self) -> Block:
+        """Returns the decoded block."""
+        return self.store.get(self.height)
+
+    @property
+    def header(self) -> BlockHeader:
+        """Returns the block header, decoded alone if the block is not cached."""
+        block = self.store.cache.get(self.height)
+        if block is not None:
+            return block.header
+        return BlockHeader.from_bytes(self.store.read_header(self.height))
+
+    @property
+    def transactions(self):
+        """Returns the decoded transactions of the block."""
+        return self.block.transactions
+
+
+class BlockStore:
+    """
+    An append-only block store. The blocks are written once to numbered segment
+    files as length prefixed records, and an index file maps every height to the
+    location of its record. Every header is also written to a headers file, so
+    the segments holding old bodies can be pruned. The files are fsynced on every
+    append, and a torn write left by a crash is cut off when the store is opened.
+    With a codec, the closed segments older than the hot ones are compressed
+    whole. The uncompressed segments are read through memory maps, the compressed
+    ones are decompressed into an LRU, and the recently decoded blocks are kept
+    in another LRU.
+
+    Attributes
+    ----------
+    directory : str
+        The directory of the segment and index files
+    segment_size : int
+        The size after which a new segment is started
+    entries : list[tuple[bytes, int, int, int]]
+        The hash, segment, offset and length of every block, in chain order
+    heights : dict[bytes, int]
+        The height of every block by hash
+    cache : LRUCache
+        The recently decoded blocks by height
+    pruned : int
+        The height of the first block whose body is kept, the bodies of the blocks
+        below it were pruned
+    codec : str
+        The codec the closed segments are compressed with, None to keep them raw
+    hot_segments : int
+        The number of most recent closed segments kept uncompressed
+    segments : LRUCache
+        The recently decompressed segments by number
+    """
+
+    def __init__(
+        self,
+        directory: str = BLOCKS_DIR,
+        segment_size: int = SEGMENT_SIZE,
+        cache_size: int = BLOCK_CACHE_SIZE,
+        codec: str = None,
+        hot_segments: int = HOT_SEGMENTS,
+        segment_cache_size: int = SEGMENT_CACHE_SIZE,
+    ) -> None:
+        if codec is not None and codec not in CODECS:
+            raise ValueError(f"Unknown codec {codec}, expected one of {list(CODECS)}")
+        self.directory: str = directory
+        self.segment_size: int = segment_size
+        self.entries: list[tuple[bytes, int, int, int]] = []
+        self.heights: dict[bytes, int] = {}
+        self.cache = LRUCache(cache_size)
+        self.pruned: int = 0
+        self.codec: str = codec
+        self.hot_segments: int = hot_segments
+        self.segments = LRUCache(segment_cache_size)
+        self._maps: dict[int, mmap.mmap] = {}
+        self._writer = None
+        os.makedirs(directory, exist_ok=True)
+        self._index = open(os.path.join(directory, "index.dat"), "ab+")
+        self._headers = open(os.path.join(directory, "headers.dat"), "ab+")
+        self.load()
+
+    def __len__(self) -> int:
+        """Returns the number of stored blocks."""
+        return len(self.entries)
+
+    def __contains__(self, hash: bytes) -> bool:
+        """Returns True if a block with this hash is stored."""
+        return hash in self.heights
+
+    def __iter__(self) -> Iterator[Block]:
+        """Iterates over the stored blocks in chain order."""
+        for height in range(len(self.entries)):
+            yield self.get(height)
+
+    def segment_path(self, segment: int) -> str:
+        """Returns the path of a segment file."""
+        return os.path.join(self.directory, f"blk{segment:05d}.dat")
+
+    def segment_file(self, segment: int) -> tuple[str, str]:
+        """Returns the path and codec of the file holding a segment, None if gone."""
+        path = self.segment_path(segment)
+        if os.path.isfile(path):
+            return path, None
+        for codec, (extension, _, _) in CODECS.items():
+            if os.path.isfile(path + extension):
+                return path + extension, codec
+        return None
+
+    def load(self) -> None:
+        """Reads the index and cuts off the records of an interrupted append."""
+        self._index.seek(0)
+        data = self._index.read()
+        extensions = [""] + [extension for extension, _, _ in CODECS.values()]
+        segments = []
+        for name in os.listdir(self.directory):
+            number, _, extension = name[3:].partition(".dat")
+            if name.startswith("blk") and number.isdigit() and extension in extensions:
+                segments.append(int(number))
+        # the segments before the first one left on disk were pruned
+        first = min(segments, default=0)
+        sizes = {}
+        for start in range(0, len(data) - INDEX_ENTRY.size + 1, INDEX_ENTRY.size):
+            hash, segment, offset, length = INDEX_ENTRY.unpack_from(data, start)
+            if segment < first:
+                self.pruned = len(self.entries) + 1
+            else:
+                if segment not in sizes:
+                    found = self.segment_file(segment)
+                    if found is None:
+                        sizes[segment] = 0
+                    elif found[1] is not None:
+                        # only closed segments are compressed, and they are whole
+                        sizes[segment] = float("inf")
+                    else:
+                        sizes[segment] = os.path.getsize(found[0])
+                if offset + RECORD_PREFIX.size + length > sizes[segment]:
+                    break
+            self.heights[hash] = len(self.entries)
+            self.entries.append((hash, segment, offset, length))
+        # stores written before the headers file existed get it filled in
+        headers = os.path.getsize(self._headers.name) // HEADER_SIZE
+        self._headers.truncate(headers * HEADER_SIZE)
+        for height in range(headers, len(self.entries)):
+            self._headers.write(self.read(height)[:HEADER_SIZE])
+        self.truncate(len(self.entries))
+        self.compact()
+
+    def append(self, block: Block) -> int:
+        """
+        Write a block at the end of the store
+
+        Parameters
+        ----------
+        block : Block
+            The block to write
+
+        Returns
+        -------
+        int
+            The height of the block in the store
+        """
+        data = bytes(block)
+        segment, offset = self.end()
+        closed = (
+            offset > 0 and offset + RECORD_PREFIX.size + len(data) > self.segment_size
+        )
+        if closed:
+            segment, offset = segment + 1, 0
+        writer = self.writer(segment)
+        writer.write(RECORD_PREFIX.pack(len(data)) + data)
+        writer.flush()
+        os.fsync(writer.fileno())
+        self._headers.write(data[:HEADER_SIZE])
+        self._headers.flush()
+        os.fsync(self._headers.fileno())
+        self._index.write(INDEX_ENTRY.pack(block.hash, segment, offset, len(data)))
+        self._index.flush()
+        os.fsync(self._index.fileno())
+        height = len(self.entries)
+        self.entries.append((block.hash, segment, offset, len(data)))
+        self.heights[block.hash] = height
+        if isinstance(block, Block):
+            self.cache.put(height, block)
+        if closed:
+            self.compact()
+        return height
+
+    def read(self, height: int) -> bytes:
+        """
+        Read the encoded block at a height
+
+        Parameters
+        ----------
+        height : int
+            The height of the block, the genesis block is 0
+
+        Returns
+        -------
+        bytes
+            The encoded block
+        """
+        if not 0 <= height < len(self.entries):
+            raise IndexError(f"No block at height {height}")
+        if height < self.pruned:
+            raise PrunedBlockError(f"The block at height {height} was pruned")
+        _, segment, offset, length = self.entries[height]
+        start = offset + RECORD_PREFIX.size
+        return self.map(segment, start + length)[start : start + length]
+
+    def read_header(self, height: int) -> bytes:
+        """Returns the encoded header of the block at a height, even if pruned."""
+        if not 0 <= height < len(self.entries):
+            raise IndexError(f"No block at height {height}")
+        return os.pread(self._headers.fileno(), HEADER_SIZE, height * HEADER_SIZE)
+
+    def prunable(self, height: int) -> list[tuple[int, int]]:
+        """
+        Get the segments that only hold blocks below a height, the segment being
+        appended to is never prunable
+
+        Parameters
+        ----------
+        height : int
+            The height of the first block whose body has to be kept
+
+        Returns
+        -------
+        list[tuple[int, int]]
+            Every prunable segment and the height of the block after it, oldest first
+        """
+        active = self.entries[-1][1] if self.entries else 0
+        segments = []
+        pruned = self.pruned
+        while pruned < min(height, len(self.entries)):
+            segment = self.entries[pruned][1]
+            end = pruned
+            while end < len(self.entries) and self.entries[end][1] == segment:
+                end += 1
+            if segment == active or end > height:
+                break
+            segments.append((segment, end))
+            pruned = end
+        return segments
+
+    def prune(self, height: int) -> int:
+        """
+        Delete the segments that only hold blocks below a height
+
+        Parameters
+        ----------
+        height : int
+            The height of the first block whose body has to be kept
+
+        Returns
+        -------
+        int
+            The height of the first block whose body is still stored
+        """
+        for segment, end in self.prunable(height):
+            if segment in self._maps:
+                self._maps.pop(segment).close()
+            self.segments.pop(segment)
+            os.remove(self.segment_file(segment)[0])
+            for stale in range(self.pruned, end):
+                self.cache.pop(stale)
+            self.pruned = end
+        return self.pruned
+
+    def map(self, segment: int, end: int) -> bytes:
+        """
+        Returns the memory map of a raw segment, remapped if it ends before end, or
+        the decompressed data of a compressed one.
+        """
+        mapped = self._maps.get(segment)
+        if mapped is not None and len(mapped) >= end:
+            return mapped
+        data = self.segments.get(segment)
+        if data is not None:
+            return data
+        path, codec = self.segment_file(segment) or (self.segment_path(segment), None)
+        if codec is not None:
+            with open(path, "rb") as f:
+                data = CODECS[codec][2](f.read())
+            self.segments.put(segment, data)
+            return data
+        if mapped is not None:
+            mapped.close()
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps[segment] = mapped
+        return mapped
+
+    def compact(self) -> None:
+        """Compresses the closed segments that are older than the hot ones."""
+        if self.codec is None or len(self.entries) <= self.pruned:
+            return
+        first = self.entries[self.pruned][1]
+        active = self.entries[-1][1]
+        for segment in range(first, active - self.hot_segments):
+            if os.path.isfile(self.segment_path(segment)):
+                self.compress(segment)
+
+    def compress(self, segment: int) -> None:
+        """
+        Replace a closed raw segment with its compressed file, the raw file is only
+        removed once the compressed one is on disk
+
+        Parameters
+        ----------
+        segment : int
+            The number of the segment
+        """
+        path = self.segment_path(segment)
+        extension, compress, _ = CODECS[self.codec]
+        with open(path, "rb") as f:
+            data = compress(f.read())
+        self.write_file(path + extension, data)
+        if segment in self._maps:
+            self._maps.pop(segment).close()
+        os.remove(path)
+
+    def decompress(self, segment: int) -> None:
+        """
+        Replace a compressed segment with its raw file, so it can be appended to
+        again after a truncation
+
+        Parameters
+        ----------
+        segment : int
+            The number of the segment
+        """
+        path, codec = self.segment_file(segment)
+        with open(path, "rb") as f:
+            data = CODECS[codec][2](f.read())
+        self.write_file(self.segment_path(segment), data)
+        self.segments.pop(segment)
+        os.remove(path)
+
+    def write_file(self, path: str, data: bytes) -> None:
+        """Writes a file atomically, it replaces nothing until it is fully on disk."""
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+        directory = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+    def get(self, height: int) -> Block:
+        """Returns the decoded block at a height, the genesis block is 0."""
+        block = self.cache.get(height)
+        if block is None:
+            block = Block.from_bytes(self.read(height))
+            self.cache.put(height, block)
+        return block
+
+    def handle(self, height: int) -> BlockHandle:
+        """Returns a lazy handle of the block at a height."""
+        if not 0 <= height < len(self.entries):
+            raise IndexError(f"No block at height {height}")
+        return BlockHandle(self, height, self.entries[height][0])
+
+    def get_by_hash(self, hash: bytes) -> Block:
+        """Returns the block with a hash, None if it is not stored."""
+        if hash not in self.heights:
+            return None
+        return self.get(self.heights[hash])
+
+    def end(self) -> tuple[int, int]:
+        """Returns the segment and offset right after the last record."""
+        if not self.entries:
+            return 0, 0
+        _, segment, offset, length = self.entries[-1]
+        return segment, offset + RECORD_PREFIX.size + length
+
+    def writer(self, segment: int):
+        """Returns the append handle of a segment, the previous one is closed."""
+        if self._writer is not None and self._writer[0] != segment:
+            self._writer[1].close()
+            self._writer = None
+        if self._writer is None:
+            self._writer = (segment, open(self.segment_path(segment), "ab"))
+        return self._writer[1]
+
+    def truncate(self, height: int) -> None:
+        """
+        Remove every block from a height on from the store
+
+        Parameters
+        ----------
+        height : int
+            The height of the first block to remove
+        """
+        if height < self.pruned:
+            raise PrunedBlockError(f"The blocks below {self.pruned} were pruned")
+        for stale, (hash, *_) in enumerate(self.entries[height:], start=height):
+            self.heights.pop(hash, None)
+            self.cache.pop(stale)
+        del self.entries[height:]
+        self.close_files()
+        last, offset = self.end()
+        segment = last
+        while (found := self.segment_file(segment)) is not None:
+            path, codec = found
+            self.segments.pop(segment)
+            if segment == last:
+                if codec is not None:
+                    self.decompress(segment)
+                with open(self.segment_path(segment), "r+b") as f:
+                    f.truncate(offset)
+                    os.fsync(f.fileno())
+            else:
+                os.remove(path)
+            segment += 1
+        for file, size in (
+            (self._index, INDEX_ENTRY.size),
+            (self._headers, HEADER_SIZE),
+        ):
+            file.truncate(len(self.entries) * size)
+            file.flush()
+            os.fsync(file.fileno())
+
+    def close_files(self) -> None:
+        """Closes the segment handles and maps, they are reopened when needed."""
+        for mapped in self._maps.values():
+            mapped.close()
+        self._maps = {}
+        if self._writer is not None:
+            self._writer[1].close()
+            self._writer = None
+
+    def close(self) -> None:
+        """Closes every file of the store."""
+        self.close_files()
+        self._index.close()
+        self._headers.close()
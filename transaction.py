@@ -1,44 +1,279 @@
-import inspect
-from dataclasses import dataclass
-from datetime import datetime
+import time
+from hashlib import sha256
 from json import dumps
 
 from ecdsa import SigningKey, VerifyingKey
+from ecdsa.ellipticcurve import PointJacobi
 from ecdsa.util import sigencode_string, sigdecode_string
 
+from datastructs import LRUCache
+
+SIGNATURE_CACHE_SIZE = 100000
+KEY_CACHE_SIZE = 4096
+PRECOMPUTE_USES = 16
+# timestamps are integer microseconds, the json encoding keeps float seconds
+TIMESTAMP_SCALE = 1000000
+# the sender of reward transactions, "0" in json
+REWARD_SENDER = b""
+
+# (txid, signature) pairs whose signature was already proven valid
+verified_signatures = LRUCache(SIGNATURE_CACHE_SIZE)
+
+
+class KeyCache:
+    """
+    Process wide cache of parsed public keys
+
+    Keys used at least PRECOMPUTE_USES times get precomputation tables, which makes
+    verifying the signatures of heavy senders faster.
+
+    Attributes
+    ----------
+    keys : LRUCache
+        The parsed key and the number of uses of every cached sender
+    precompute_uses : int
+        The number of uses after which a key gets precomputation tables
+    worker_hits : int
+        The hits of the caches of the verification worker processes
+    worker_misses : int
+        The misses of the caches of the verification worker processes
+    """
+
+    def __init__(
+        self, maxsize: int = KEY_CACHE_SIZE, precompute_uses: int = PRECOMPUTE_USES
+    ) -> None:
+        self.keys = LRUCache(maxsize)
+        self.precompute_uses: int = precompute_uses
+        self.worker_hits: int = 0
+        self.worker_misses: int = 0
+
+    @property
+    def hits(self) -> int:
+        """returns the number of lookups that found a parsed key, in every process"""
+        return self.keys.hits + self.worker_hits
+
+    @property
+    def misses(self) -> int:
+        """returns the number of lookups that had to parse the key, in every process"""
+        return self.keys.misses + self.worker_misses
+
+    def count_worker(self, hits: int, misses: int) -> None:
+        """
+        adds the lookups a worker process made with its own cache
+
+        Parameters
+        ----------
+        hits : int
+            the number of hits of the worker
+        misses : int
+            the number of misses of the worker
+        """
+        self.worker_hits += hits
+        self.worker_misses += misses
+
+    def get(self, sender: bytes) -> VerifyingKey:
+        """
+        returns the parsed public key of a sender
+
+        Parameters
+        ----------
+        sender : bytes
+            the raw public key
+
+        Returns
+        -------
+        VerifyingKey
+            the parsed public key
+        """
+        entry = self.keys.get(sender)
+        if entry is None:
+            entry = [VerifyingKey.from_string(sender), 0]
+            self.keys.put(sender, entry)
+        entry[1] += 1
+        if entry[1] == self.precompute_uses:
+            entry[0] = self.precompute(entry[0])
+        return entry[0]
+
+    @staticmethod
+    def precompute(key: VerifyingKey) -> VerifyingKey:
+        """
+        returns a copy of the key with precomputation tables for its point
+
+        Parameters
+        ----------
+        key : VerifyingKey
+            the parsed public key
+
+        Returns
+        -------
+        VerifyingKey
+            the public key with precomputation tables
+        """
+        # points decoded from bytes carry no curve order, which the tables need
+        point = key.pubkey.point
+        point = PointJacobi(
+            point.curve(), point.x(), point.y(), 1, key.curve.order, generator=True
+        )
+        return VerifyingKey.from_public_point(point, key.curve, validate_point=False)
+
+
+public_keys = KeyCache()
+
+
+def to_hex(raw: bytes) -> str:
+    """returns the hex encoding of a key or hash, empty bytes are encoded as 0"""
+    if raw is None:
+        return None
+    return raw.hex() if raw else "0"
+
+
+def from_hex(value: str) -> bytes:
+    """returns the raw bytes of a hex encoded key, hash or signature"""
+    if value is None:
+        return None
+    return b"" if value in ("0", "") else bytes.fromhex(value)
+
+
+def sigencode_low_s(r: int, s: int, order: int) -> bytes:
+    """
+    encodes a signature with the lower of its two valid s values
+
+    (r, order - s) verifies whenever (r, s) does, keeping only the low one means
+    a signed transaction has a single encoding and so a single id
+
+    Parameters
+    ----------
+    r : int
+        the r value of the signature
+    s : int
+        the s value of the signature
+    order : int
+        the order of the curve
+
+    Returns
+    -------
+    bytes
+        the raw signature
+    """
+    return sigencode_string(r, min(s, order - s), order)
+
+
+def now() -> int:
+    """returns the current time as an integer timestamp"""
+    return time.time_ns() // 1000
+
+
+def to_timestamp(seconds: float) -> int:
+    """returns the integer timestamp of a time in seconds"""
+    return None if seconds is None else round(seconds * TIMESTAMP_SCALE)
+
+
+def to_amount(value) -> int:
+    """returns an amount as an integer, fractional amounts are rejected"""
+    if value is None:
+        return None
+    if value != int(value):
+        raise ValueError(f"Amount {value} is not an integer")
+    return int(value)
+
 
-@dataclass
 class Transaction:
     """
     Transaction class
 
+    Keys and signatures are raw bytes and timestamps integer microseconds, they
+    are only converted to hex and seconds in the json encoding.
+
     Attributes
     ----------
-    sender : str
-        Sender of the transaction
-    recipient : str
+    sender : bytes
+        Sender of the transaction, empty for rewards
+    recipient : bytes
         Recipient of the transaction
     amount : int
         Amount of the transaction
-    timestamp: datetime
+    timestamp: int
         Timestamp of the transaction
     data: dict
         Extra data of the transaction
-    signature : str
+    signature : bytes
         Signature of the transaction
     """
 
-    amount: float = None
-    data: dict = None
-    recipient: str = None
-    sender: str = None
-    signature: str = None
-    timestamp: datetime = None
+    __slots__ = (
+        "amount",
+        "data",
+        "recipient",
+        "sender",
+        "signature",
+        "timestamp",
+        "_txid",
+    )
+
+    def __init__(
+        self,
+        amount: int = None,
+        data: dict = None,
+        recipient: bytes = None,
+        sender: bytes = None,
+        signature: bytes = None,
+        timestamp: int = None,
+    ) -> None:
+        self.amount: int = amount
+        self.data: dict = data
+        self.recipient: bytes = recipient
+        self.sender: bytes = sender
+        self.signature: bytes = signature
+        self.timestamp: int = timestamp
+
+    def _fields(self) -> tuple:
+        """returns the fields of the transaction, without the cached id"""
+        return tuple(getattr(self, name) for name in self.__slots__[:-1])
+
+    def __eq__(self, other) -> bool:
+        """returns True if every field of the two transactions is equal"""
+        if not isinstance(other, Transaction):
+            return NotImplemented
+        return self._fields() == other._fields()
+
+    def __repr__(self) -> str:
+        """returns the fields of the transaction"""
+        fields = ", ".join(
+            f"{name}={value!r}" for name, value in zip(self.__slots__, self._fields())
+        )
+        return f"Transaction({fields})"
+
+    @property
+    def size(self) -> int:
+        """returns the size of the signed transaction in bytes"""
+        return len(self.to_json(include_signature=True))
+
+    def __setattr__(self, name: str, value) -> None:
+        """sets a field and drops the cached transaction id"""
+        object.__setattr__(self, name, value)
+        if name != "_txid":
+            object.__setattr__(self, "_txid", None)
 
     @property
-    def size(self):
-        """returns the size of the transaction in bytes"""
-        return len(dumps(self.data))
+    def txid(self) -> bytes:
+        """returns the hash of the canonical signed encoding, cached per instance"""
+        if self._txid is None:
+            canonical = dumps(
+                self.to_dict(include_signature=True),
+                sort_keys=True,
+                separators=(",", ":"),
+            )
+            self._txid = sha256(canonical.encode()).digest()
+        return self._txid
+
+    @property
+    def verified(self) -> bool:
+        """returns True if the signature was already proven valid"""
+        return verified_signatures.get((self.txid, self.signature), False)
+
+    def mark_verified(self) -> None:
+        """records the signature as proven valid"""
+        verified_signatures.put((self.txid, self.signature), True)
 
     @classmethod
     def from_json(cls, json_data: dict):
@@ -56,14 +291,12 @@ class Transaction:
             the transaction created from the json string
         """
         return cls(
-            **{
-                key: (
-                    json_data[key]
-                    if val.default == val.empty
-                    else json_data.get(key, val.default)
-                )
-                for key, val in inspect.signature(Transaction).parameters.items()
-            }
+            amount=to_amount(json_data["amount"]),
+            data=json_data.get("data"),
+            recipient=from_hex(json_data["recipient"]),
+            sender=from_hex(json_data["sender"]),
+            signature=from_hex(json_data.get("signature")),
+            timestamp=to_timestamp(json_data["timestamp"]),
         )
 
     def to_dict(self, include_signature: bool = False) -> dict:
@@ -81,12 +314,17 @@ class Transaction:
             the transaction as a dict
         """
         data = {
-            key: val
-            for key, val in self.__dict__.items()
-            if val is not None and key != "signature"
+            "amount": self.amount,
+            "data": self.data,
+            "recipient": to_hex(self.recipient),
+            "sender": to_hex(self.sender),
+            "timestamp": (
+                None if self.timestamp is None else self.timestamp / TIMESTAMP_SCALE
+            ),
         }
+        data = {key: value for key, value in data.items() if value is not None}
         if include_signature:
-            data["signature"] = self.signature
+            data["signature"] = None if self.signature is None else self.signature.hex()
         return data
 
     def to_json(self, include_signature: bool = False) -> str:
@@ -115,20 +353,33 @@ class Transaction:
             the private key to sign the transaction with
         """
         self.signature = private_key.sign(
-            self.to_json().encode(), sigencode=sigencode_string
-        ).hex()
+            self.to_json().encode(), sigencode=sigencode_low_s
+        )
 
     def verify(self) -> bool:
         """
-        verifies the transaction with the given public key
+        verifies the transaction with the given public key, signatures that were
+        already verified are looked up in the signature cache. Only signatures with
+        a low s are accepted, the high s twin of a signature would give the same
+        transaction another id.
 
         Returns
         -------
         bool
             True if the transaction is valid, False otherwise
         """
-        return VerifyingKey.from_string(bytearray.fromhex(self.sender)).verify(
-            bytearray.fromhex(self.signature),
+        if self.verified:
+            return True
+        key = public_keys.get(self.sender)
+        order = key.curve.order
+        _, s = sigdecode_string(self.signature, order)
+        if s > order // 2:
+            return False
+        valid = key.verify(
+            self.signature,
             self.to_json().encode(),
             sigdecode=sigdecode_string,
         )
+        if valid:
+            self.mark_verified()
+        return valid
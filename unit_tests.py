@@ -1,35 +1,786 @@
+import json
+import os
 import unittest
+from tempfile import TemporaryDirectory
+from threading import Event, Thread
 from daemon import *
 from config import *
+from block import BlockHeader, HEADER_SIZE, NULL_HASH
+from datastructs import LRUCache
+from transaction import KeyCache, REWARD_SENDER, TIMESTAMP_SCALE, now, public_keys
+from difficulty import *
+from ecdsa.util import sigdecode_string, sigencode_string
+from merkle import merkle_root, verify_proof
+from mempool import Mempool
+from store import BlockStore, PrunedBlockError
+from snapshot import SnapshotStore
+from legacy import LEGACY_PATH, import_blocks, read_blocks
+from blocktree import BlockTree
+from verification import verify_transaction
+from validation import ChainValidator, ValidationError, structure_error
 
 d = Daemon(logger)
 d.start()
 
 
+def signed_transaction(amount):
+    transaction = Transaction()
+    transaction.sender = d.wallet.public_key
+    transaction.recipient = REWARD_SENDER
+    transaction.amount = amount
+    transaction.timestamp = now()
+    transaction.sign(d.wallet.private_key)
+    return transaction
+
+
+def mine_block(chain, transactions):
+    block = Block.create(
+        chain.last_block.hash,
+        d.wallet.public_key,
+        chain.next_difficulty(),
+        chain.height + 1,
+        transactions,
+    )
+    block.proof_of_work()
+    chain.add_block(block)
+    return block
+
+
 class MyTestCase(unittest.TestCase):
     def test_signature(self):
 
         transaction = Transaction()
         transaction.sender = d.wallet.public_key
-        transaction.recipient = "0"
+        transaction.recipient = REWARD_SENDER
         transaction.amount = 1000
-        transaction.timestamp = datetime.now().timestamp()
+        transaction.timestamp = now()
         transaction.sign(d.wallet.private_key)
         self.assertTrue(transaction.verify())
 
+    def test_transaction_encoding(self):
+        transaction = signed_transaction(7)
+        self.assertFalse(hasattr(transaction, "__dict__"))
+        data = json.loads(transaction.to_json(include_signature=True))
+        self.assertEqual(data["sender"], d.wallet.public_key.hex())
+        self.assertEqual(data["recipient"], "0")
+        self.assertIsInstance(data["timestamp"], float)
+        decoded = Transaction.from_json(data)
+        self.assertEqual(decoded, transaction)
+        self.assertIsInstance(decoded.signature, bytes)
+        self.assertEqual(decoded.txid, transaction.txid)
+        self.assertTrue(verify_transaction(decoded))
+        data["amount"] = 1.5
+        self.assertRaises(ValueError, Transaction.from_json, data)
+
+    def test_signature_cache(self):
+        transaction = Transaction()
+        transaction.sender = d.wallet.public_key
+        transaction.recipient = REWARD_SENDER
+        transaction.amount = 5
+        transaction.timestamp = now()
+        transaction.sign(d.wallet.private_key)
+        self.assertFalse(transaction.verified)
+        self.assertTrue(transaction.verify())
+        self.assertTrue(transaction.verified)
+        transaction.amount = 6
+        self.assertFalse(transaction.verified)
+
+    def test_admission_verification(self):
+        chain = Blockchain.generate()
+        tree = BlockTree(chain)
+        transactions = [signed_transaction(amount) for amount in range(1, 4)]
+        for transaction in transactions:
+            self.assertFalse(transaction.verified)
+            self.assertTrue(chain.add_transaction(transaction))
+            self.assertTrue(transaction.verified)
+        block = Block.create(
+            chain.last_block.hash,
+            d.wallet.public_key,
+            chain.next_difficulty(),
+            1,
+            transactions,
+        )
+        block.proof_of_work()
+        lookups = public_keys.hits + public_keys.misses
+        # a peer block holds fresh copies of the pending transactions
+        self.assertTrue(tree.add(Block.from_json(block.to_dict())))
+        self.assertEqual(public_keys.hits + public_keys.misses, lookups)
+        self.assertEqual(len(chain.ether), 0)
+
+    def test_key_cache(self):
+        keys = KeyCache(precompute_uses=3)
+        key = keys.get(d.wallet.public_key)
+        self.assertIs(keys.get(d.wallet.public_key), key)
+        self.assertEqual((keys.hits, keys.misses), (1, 1))
+        precomputed = keys.get(d.wallet.public_key)
+        self.assertEqual(precomputed.to_string(), d.wallet.public_key)
+        signature = d.wallet.private_key.sign(b"data")
+        self.assertTrue(precomputed.verify(signature, b"data"))
+
+    def test_lru_cache(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertNotIn("b", cache)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual((cache.hits, cache.misses), (2, 0))
+
+    def test_verify_batch(self):
+        transactions = []
+        for amount in range(4):
+            transaction = Transaction()
+            transaction.sender = d.wallet.public_key
+            transaction.recipient = REWARD_SENDER
+            transaction.amount = amount
+            transaction.timestamp = now()
+            transaction.sign(d.wallet.private_key)
+            transactions.append(transaction)
+        transactions[2].amount = 100
+        before = d.key_cache_stats()
+        self.assertEqual(
+            verify_batch(transactions, min_batch=1), [True, True, False, True]
+        )
+        # the lookups of the worker processes are counted here too
+        after = d.key_cache_stats()
+        lookups = after["hits"] + after["misses"] - before["hits"] - before["misses"]
+        self.assertEqual(lookups, 4)
+        self.assertEqual(verify_batch(transactions), [True, True, False, True])
+
     def test_proof_of_work(self):
         block = Block.create(
+            NULL_HASH,
             d.wallet.public_key,
-            "0",
-            0,
+            MAX_BITS,
             0,
             [Transaction()],
         )
-        self.assertTrue(block.proof_of_work(lambda: False))
+        self.assertTrue(block.proof_of_work())
+        self.assertLessEqual(int.from_bytes(block.header.hash, "big"), MAX_TARGET)
+
+    def test_header_encoding(self):
+        block = Block.create(
+            NULL_HASH, d.wallet.public_key, MAX_BITS, 1, [Transaction()]
+        )
+        block.proof_of_work()
+        header = BlockHeader.from_bytes(bytes(block.header))
+        self.assertEqual(len(bytes(block.header)), HEADER_SIZE)
+        self.assertEqual(header.hash, block.header.hash)
+        self.assertEqual(header.miner_address, block.header.miner_address)
+
+    def test_parallel_proof_of_work(self):
+        block = Block.create(
+            NULL_HASH,
+            d.wallet.public_key,
+            target_to_bits(MAX_TARGET >> 4),
+            1,
+            [Transaction()],
+        )
+        miner = Miner(2)
+        self.assertTrue(miner.proof_of_work(block, Event()))
+        self.assertTrue(block.valid_proof())
+        # the worker processes are kept for the next block
+        pids = [process.pid for process in miner.processes]
+        block.header.timestamp += 1
+        self.assertTrue(miner.proof_of_work(block, Event()))
+        self.assertTrue(block.valid_proof())
+        self.assertEqual([process.pid for process in miner.processes], pids)
+        miner.close()
+        self.assertEqual(miner.processes, [])
+
+    def test_mining_stats(self):
+        miner = Miner(1)
+        block = Block.create(
+            NULL_HASH, d.wallet.public_key, MAX_BITS, 1, [Transaction()]
+        )
+        miner.proof_of_work(block, Event())
+        stats = miner.stats
+        self.assertEqual(stats.blocks_mined, 1)
+        self.assertEqual(stats.last_attempts, block.header.nonce + 1)
+        self.assertEqual(stats.difficulty, MAX_BITS)
+
+    def test_cancel_proof_of_work(self):
+        block = Block.create(
+            NULL_HASH, d.wallet.public_key, target_to_bits(1), 1, [Transaction()]
+        )
+        cancel = Event()
+        cancel.set()
+        self.assertFalse(Miner(2).proof_of_work(block, cancel))
+
+    def test_difficulty_bits(self):
+        self.assertEqual(bits_to_target(0x1D00FFFF), 0xFFFF << 208)
+        self.assertEqual(target_to_bits(0xFFFF << 208), 0x1D00FFFF)
+        self.assertLessEqual(bits_to_target(MAX_BITS), MAX_TARGET)
+
+    def test_retarget(self):
+        bits = target_to_bits(MAX_TARGET >> 8)
+        slow = [i * TARGET_BLOCK_TIME * 2 for i in range(RETARGET_WINDOW)]
+        fast = [i * TARGET_BLOCK_TIME / 2 for i in range(RETARGET_WINDOW)]
+        on_time = [i * TARGET_BLOCK_TIME for i in range(RETARGET_WINDOW)]
+        window = RETARGET_WINDOW
+        self.assertGreater(
+            bits_to_target(retarget(slow, bits, window)), bits_to_target(bits)
+        )
+        self.assertLess(
+            bits_to_target(retarget(fast, bits, window)), bits_to_target(bits)
+        )
+        self.assertEqual(retarget(on_time, bits, window), bits)
+        # the target only changes once per window
+        self.assertEqual(retarget(fast, bits, window + 1), bits)
+        stalled = [0] * (RETARGET_WINDOW - 1) + [10**9]
         self.assertEqual(
-            block.header.hash[: block.header.difficulty], "0" * block.header.difficulty
+            bits_to_target(retarget(stalled, bits, window)),
+            bits_to_target(bits) * MAX_ADJUSTMENT,
         )
 
+    def test_block_timestamps(self):
+        chain = Blockchain.generate()
+        for amount in range(1, 4):
+            mine_block(chain, [signed_transaction(amount)])
+        timestamps = [block.header.timestamp / TIMESTAMP_SCALE for block in chain.chain]
+        for offset, reason in [(0, "median"), (3 * MAX_FUTURE_TIME, "future")]:
+            block = Block.create(
+                chain.last_block.hash,
+                d.wallet.public_key,
+                chain.next_difficulty(),
+                chain.height + 1,
+                [signed_transaction(1)],
+            )
+            block.header.timestamp = round((timestamps[1] + offset) * TIMESTAMP_SCALE)
+            self.assertIn(
+                reason,
+                structure_error(
+                    block,
+                    chain.height + 1,
+                    chain.last_block.hash,
+                    chain.next_difficulty(),
+                    timestamps,
+                ),
+            )
+
+    def test_balance_index(self):
+        chain = Blockchain.generate()
+        sender = chain.last_block.transactions[0].recipient
+        recipient = Wallet.generate().public_key
+        transaction = Transaction()
+        transaction.sender = sender
+        transaction.recipient = recipient
+        transaction.amount = 10
+        block = Block.create(
+            chain.last_block.hash, NULL_HASH, MAX_BITS, 1, [transaction]
+        )
+        chain.add_block(block)
+        self.assertEqual(chain.balances.get(sender), 990)
+        self.assertEqual(chain.balances.get(recipient), 10)
+        chain.pop_block()
+        self.assertEqual(chain.balances.get(sender), 1000)
+        self.assertEqual(chain.balances.get(recipient), 0)
+
+    def test_undo_window(self):
+        chain = Blockchain.generate()
+        chain.undo_depth = 2
+        for amount in range(1, 5):
+            mine_block(chain, [signed_transaction(amount)])
+        self.assertEqual(sorted(chain.undo), [3, 4])
+        self.assertEqual(sorted(chain.snapshot()["undo"]), [3, 4])
+        chain.pop_block()
+        chain.pop_block()
+        with self.assertRaises(PrunedBlockError):
+            chain.pop_block()
+
+    def test_chain_validation(self):
+        chain = Blockchain.generate()
+        mine_block(chain, [signed_transaction(10)])
+        mine_block(chain, [signed_transaction(20)])
+        data = chain.to_dict()
+        blockchain, report = ChainValidator().validate(data)
+        self.assertTrue(report.valid)
+        self.assertEqual(blockchain.height, 2)
+        self.assertEqual(blockchain.balances.get(d.wallet.public_key), 970)
+        data["2"]["transactions"][0]["amount"] = 1
+        blockchain, report = ChainValidator().validate(data)
+        self.assertEqual(report.error.height, 2)
+        self.assertEqual(blockchain.height, 1)
+
+    def test_chain_index(self):
+        chain = Blockchain.generate()
+        for amount in range(1, 4):
+            mine_block(chain, [signed_transaction(amount)])
+        blocks = chain.chain
+        self.assertEqual([block.header.height for block in blocks], [0, 1, 2, 3])
+        self.assertEqual(blocks.tip, chain.last_block)
+        self.assertEqual(blocks.height_of(blocks[2].hash), 2)
+        self.assertIs(blocks.get(blocks[1].hash), blocks[1])
+        self.assertIs(blocks.ancestor(blocks.tip.hash, 3), blocks[0])
+        self.assertIsNone(blocks.ancestor(blocks[1].hash, 2))
+        self.assertEqual(blocks[1:3], blocks.blocks[1:3])
+        removed = blocks.truncate(2)
+        self.assertEqual(len(removed), 2)
+        self.assertNotIn(removed[0].hash, blocks)
+
+    def test_address_index(self):
+        chain = Blockchain.generate()
+        transaction = signed_transaction(10)
+        transaction.recipient = d.wallet.public_key
+        transaction.sign(d.wallet.private_key)
+        mine_block(chain, [transaction, signed_transaction(20)])
+        mine_block(chain, [signed_transaction(30)])
+        address = d.wallet.public_key
+        self.assertEqual(chain.addresses.count(address), 4)
+        self.assertEqual(chain.addresses.page(address, 0, 3), [(2, 0), (1, 1), (1, 0)])
+        self.assertEqual(chain.addresses.page(address, 1, 3), [(0, 0)])
+        self.assertEqual(chain.addresses.page(address, 2, 3), [])
+        chain.pop_block()
+        self.assertEqual(chain.addresses.page(address), [(1, 1), (1, 0), (0, 0)])
+
+    def test_transaction_index(self):
+        chain = Blockchain.generate()
+        transaction = signed_transaction(10)
+        txid = transaction.txid
+        mine_block(chain, [signed_transaction(5), transaction])
+        self.assertEqual(chain.get_transaction(txid), (transaction, 1, 1))
+        reloaded = Transaction.from_json(transaction.to_dict(include_signature=True))
+        self.assertEqual(reloaded.txid, txid)
+        reloaded.amount = 11
+        self.assertNotEqual(reloaded.txid, txid)
+        replay = Block.create(
+            chain.last_block.hash,
+            d.wallet.public_key,
+            chain.next_difficulty(),
+            2,
+            [transaction],
+        )
+        replay.proof_of_work()
+        self.assertFalse(BlockTree(chain).add(replay))
+        self.assertEqual(chain.get_transaction(txid), (transaction, 1, 1))
+        chain.pop_block()
+        self.assertIsNone(chain.get_transaction(txid))
+
+    def test_malleated_signature(self):
+        chain = Blockchain.generate()
+        transaction = signed_transaction(40)
+        mine_block(chain, [transaction])
+        order = d.wallet.private_key.curve.order
+        r, s = sigdecode_string(transaction.signature, order)
+        self.assertLessEqual(s, order // 2)
+        malleated = Transaction.from_json(transaction.to_dict(include_signature=True))
+        malleated.signature = sigencode_string(r, order - s, order)
+        self.assertNotEqual(malleated.txid, transaction.txid)
+        self.assertFalse(verify_transaction(malleated))
+        block = Block.create(
+            chain.last_block.hash,
+            d.wallet.public_key,
+            chain.next_difficulty(),
+            2,
+            [malleated],
+        )
+        block.proof_of_work()
+        self.assertFalse(BlockTree(chain).add(block))
+        self.assertEqual(chain.balances.get(d.wallet.public_key), 960)
+
+    def test_merkle_proof(self):
+        transactions = [signed_transaction(amount) for amount in range(5)]
+        block = Block.create(NULL_HASH, d.wallet.public_key, MAX_BITS, 1, transactions)
+        for index, transaction in enumerate(transactions):
+            proof = block.merkle_proof(index)
+            self.assertTrue(
+                verify_proof(transaction.txid, proof, block.header.merkle_root)
+            )
+        proof = block.merkle_proof(1)
+        self.assertFalse(
+            verify_proof(transactions[2].txid, proof, block.header.merkle_root)
+        )
+
+    def test_mutated_block(self):
+        chain = Blockchain.generate()
+        tree = BlockTree(chain)
+        transactions = [signed_transaction(amount) for amount in range(1, 4)]
+        block = Block.create(
+            chain.last_block.hash,
+            d.wallet.public_key,
+            chain.next_difficulty(),
+            1,
+            transactions,
+        )
+        block.proof_of_work()
+        # duplicating the last transaction keeps the merkle root and the hash
+        mutated = Block(block.header, transactions + transactions[-1:])
+        self.assertEqual(merkle_root(mutated.txids), block.header.merkle_root)
+        self.assertFalse(tree.add(mutated))
+        self.assertEqual(chain.balances.get(d.wallet.public_key), 1000)
+        self.assertTrue(tree.add(block))
+        self.assertEqual(chain.balances.get(d.wallet.public_key), 994)
+
+    def test_mempool(self):
+        transactions = [signed_transaction(amount) for amount in range(1, 5)]
+        for offset, transaction in enumerate(transactions):
+            transaction.timestamp = 1000 - offset
+        pool = Mempool(max_transactions=3)
+        self.assertTrue(pool.add(transactions[1]))
+        self.assertFalse(pool.add(transactions[1]))
+        self.assertTrue(pool.add(transactions[0]))
+        self.assertTrue(pool.add(transactions[2]))
+        # the declared timestamps are ignored, the newest transaction is evicted
+        self.assertFalse(pool.add(transactions[3]))
+        self.assertEqual(pool.select(), [transactions[i] for i in (1, 0, 2)])
+        self.assertEqual(pool.select(2), [transactions[1], transactions[0]])
+        by_timestamp = Mempool(priority=lambda transaction: transaction.timestamp)
+        for transaction in transactions:
+            by_timestamp.add(transaction)
+        self.assertEqual(by_timestamp.select(), transactions[::-1])
+        self.assertEqual(len(pool.from_sender(d.wallet.public_key)), 3)
+        pool.remove_transactions(transactions[:1])
+        self.assertNotIn(transactions[0].txid, pool)
+        self.assertEqual(pool.size, sum(t.size for t in transactions[1:3]))
+
+    def test_select_transactions(self):
+        balance = d.get_balance(d.wallet.public_key)
+        transactions = [signed_transaction(balance // 2) for _ in range(3)]
+        for transaction in transactions:
+            # bypass the admission checks, the balance may drop after admission
+            d.blockchain.ether.add(transaction)
+        self.assertEqual(d.select_transactions(), transactions[:2])
+        self.assertNotIn(transactions[2].txid, d.blockchain.ether)
+        d.blockchain.ether.remove_transactions(transactions)
+
+    def test_add_transaction(self):
+        chain = Blockchain.generate()
+        balance = chain.balances.get(d.wallet.public_key)
+        forged = signed_transaction(1)
+        forged.amount = 2
+        self.assertFalse(chain.add_transaction(forged))
+        reward = Transaction(
+            amount=1, recipient=d.wallet.public_key, sender=REWARD_SENDER
+        )
+        self.assertFalse(chain.add_transaction(reward))
+        unknown = signed_transaction(1)
+        unknown.sender = b"not a key"
+        self.assertFalse(chain.add_transaction(unknown))
+        first = signed_transaction(balance - 10)
+        self.assertTrue(chain.add_transaction(first))
+        self.assertFalse(chain.add_transaction(first))
+        # the pending spends of the sender count against its balance
+        self.assertFalse(chain.add_transaction(signed_transaction(11)))
+        self.assertTrue(chain.add_transaction(signed_transaction(10)))
+        self.assertEqual(len(chain.ether), 2)
+
+    def test_block_store(self):
+        chain = Blockchain.generate()
+        for amount in range(1, 4):
+            mine_block(chain, [signed_transaction(amount)])
+        with TemporaryDirectory() as directory:
+            store = BlockStore(directory, segment_size=1024)
+            chain.attach(store)
+            mine_block(chain, [signed_transaction(4)])
+            self.assertGreater(store.entries[-1][1], 0)
+            store.close()
+            # a torn write at the end of the log is cut off on open
+            with open(store.segment_path(store.entries[-1][1]), "ab") as f:
+                f.write(b"\x00\x00\x10\x00partial")
+            store = BlockStore(directory, segment_size=1024)
+            self.assertEqual(len(store), len(chain.chain))
+            for height, block in enumerate(chain.chain):
+                self.assertEqual(store.get(height).to_dict(), block.to_dict())
+            self.assertEqual(
+                store.get_by_hash(chain.last_block.hash).hash, chain.last_block.hash
+            )
+            chain.store = store
+            block = chain.pop_block()
+            self.assertEqual(len(store), len(chain.chain))
+            self.assertNotIn(block.hash, store)
+            store.close()
+
+    def test_lazy_blocks(self):
+        chain = Blockchain.generate()
+        for amount in range(1, 5):
+            mine_block(chain, [signed_transaction(amount)])
+        with TemporaryDirectory() as directory:
+            store = BlockStore(directory, cache_size=2)
+            chain.attach(store)
+            store.close()
+            store = BlockStore(directory, cache_size=2)
+            loaded = Blockchain.from_store(store)
+            self.assertEqual(len(store.cache), 2)
+            self.assertEqual(loaded.balances.balances, chain.balances.balances)
+            handle = loaded.chain[0]
+            self.assertNotIn(0, store.cache)
+            self.assertEqual(handle.header.hash, handle.hash)
+            self.assertNotIn(0, store.cache)
+            self.assertEqual(handle.to_dict(), chain.chain[0].to_dict())
+            self.assertIn(0, store.cache)
+            store.close()
+
+    def test_snapshots(self):
+        chain = Blockchain.generate()
+        with TemporaryDirectory() as directory:
+            store = BlockStore(os.path.join(directory, "blocks"))
+            chain.attach(store)
+            chain.snapshots = SnapshotStore(os.path.join(directory, "snapshots"), 2)
+            for amount in range(1, 6):
+                mine_block(chain, [signed_transaction(amount)])
+            self.assertEqual([h for h, _ in chain.snapshots.snapshots()], [5, 3])
+            hashes = [entry[0] for entry in store.entries]
+            state = chain.snapshots.load(hashes)
+            self.assertEqual(state["height"], 5)
+            self.assertIsNone(chain.snapshots.load(hashes[:3] + [NULL_HASH] * 3))
+            state = chain.snapshots.load(hashes[:5])
+            self.assertEqual(state["height"], 3)
+            loaded = Blockchain.from_store(store, state)
+            self.assertEqual(loaded.snapshot(), chain.snapshot())
+            loaded.pop_block()
+            replayed = Blockchain.from_store(store)
+            self.assertEqual(loaded.snapshot(), replayed.snapshot())
+            store.close()
+
+    def test_pruning(self):
+        chain = Blockchain.generate()
+        with TemporaryDirectory() as directory:
+            store = BlockStore(os.path.join(directory, "blocks"), segment_size=2000)
+            chain.attach(store)
+            chain.snapshots = SnapshotStore(os.path.join(directory, "snapshots"), 100)
+            chain.retention = 3
+            for amount in range(1, 9):
+                mine_block(chain, [signed_transaction(amount)])
+            self.assertGreater(store.pruned, 0)
+            self.assertLessEqual(store.pruned, chain.height - 3 + 1)
+            self.assertFalse(os.path.isfile(store.segment_path(0)))
+            self.assertNotIn(store.pruned - 1, chain.undo)
+            headers = chain.get_headers()
+            self.assertTrue(chain.chain[0].pruned)
+            with self.assertRaises(PrunedBlockError):
+                chain.chain[0].transactions
+            tx = chain.last_block.transactions[-1]
+            self.assertIsNotNone(chain.get_transaction(tx.txid))
+            blockchain, d.blockchain = d.blockchain, chain
+            try:
+                self.assertIsNone(d.get_block(chain.chain[0].hash.hex()))
+                self.assertIsNotNone(d.get_block(chain.last_block.hash.hex()))
+                blocks = d.get_chain()
+                self.assertEqual(blocks["0"], {"header": headers[0].hex()})
+                self.assertEqual(blocks[str(chain.height)], chain.last_block.to_dict())
+            finally:
+                d.blockchain = blockchain
+            store.close()
+            store = BlockStore(os.path.join(directory, "blocks"), segment_size=2000)
+            self.assertEqual(store.pruned, chain.store.pruned)
+            self.assertRaises(PrunedBlockError, Blockchain.from_store, store)
+            hashes = [entry[0] for entry in store.entries]
+            loaded = Blockchain.from_store(store, chain.snapshots.load(hashes))
+            self.assertEqual(loaded.balances.balances, chain.balances.balances)
+            self.assertEqual(loaded.get_headers(), headers)
+            store.close()
+
+    def test_segment_compression(self):
+        chain = Blockchain.generate()
+        for amount in range(1, 9):
+            mine_block(chain, [signed_transaction(amount)])
+        with TemporaryDirectory() as directory:
+            path = os.path.join(directory, "blocks")
+            store = BlockStore(path, segment_size=2000, codec="lzma")
+            chain.attach(store)
+            active = store.entries[-1][1]
+            self.assertEqual(store.segment_file(active - 1)[1], None)
+            self.assertEqual(store.segment_file(0)[1], "lzma")
+            block = Block.from_bytes(store.read(0))
+            self.assertEqual(block.hash, chain.chain[0].hash)
+            self.assertIn(0, store.segments)
+            store.close()
+            store = BlockStore(path, segment_size=2000, codec="zlib", hot_segments=0)
+            self.assertEqual(store.segment_file(0)[1], "lzma")
+            self.assertEqual(store.segment_file(active - 1)[1], "zlib")
+            hashes = [block.hash for block in store]
+            self.assertEqual(hashes, chain.chain.hashes())
+            store.truncate(2)
+            self.assertEqual(store.segment_file(0)[1], None)
+            self.assertEqual(store.get(1).hash, chain.chain[1].hash)
+            store.close()
+
+    def test_fork_reorganization(self):
+        chain = Blockchain.generate()
+        mine_block(chain, [signed_transaction(1)])
+        fork = Blockchain(chain.chain[:2])
+        other = Blockchain(chain.chain[:2])
+        main = mine_block(chain, [signed_transaction(2)])
+        tree = BlockTree(chain)
+        self.assertFalse(tree.add(main))
+        first = mine_block(fork, [signed_transaction(3)])
+        self.assertTrue(tree.add(first))
+        self.assertEqual(chain.last_block, main)
+        self.assertTrue(tree.add(mine_block(fork, [signed_transaction(4)])))
+        self.assertEqual(chain.chain.hashes(), fork.chain.hashes())
+        self.assertEqual(chain.balances.balances, fork.balances.balances)
+        self.assertEqual(chain.total_work, fork.total_work)
+        self.assertIn(main.hash, tree.branches)
+        self.assertIn(main.transactions[0].txid, chain.ether)
+        # a branch that overspends is rolled back once it has more work
+        blocks = [mine_block(other, [signed_transaction(5)])]
+        blocks.append(mine_block(other, [signed_transaction(10**6)]))
+        blocks.append(mine_block(other, [signed_transaction(6)]))
+        self.assertEqual([tree.add(block) for block in blocks], [True, True, False])
+        self.assertEqual(chain.chain.hashes(), fork.chain.hashes())
+        self.assertEqual(tree.invalid, {block.hash for block in blocks[1:]})
+
+    def test_chain_lock(self):
+        chain = Blockchain.generate()
+        tree = BlockTree(chain)
+        block = mine_block(Blockchain(chain.chain), [signed_transaction(1)])
+        with chain.lock:
+            adder = Thread(target=tree.add, args=(block,))
+            adder.start()
+            adder.join(0.2)
+            # the block waits for the reader to release the chain
+            self.assertTrue(adder.is_alive())
+            self.assertEqual(chain.height, 0)
+        adder.join()
+        self.assertEqual(chain.last_block, block)
+
+    def test_reward_validation(self):
+        chain = Blockchain.generate()
+        tree = BlockTree(chain)
+        holder = chain.last_block.transactions[0].recipient
+
+        def reward(amount):
+            transaction = Transaction()
+            transaction.sender = REWARD_SENDER
+            transaction.recipient = holder
+            transaction.amount = amount
+            transaction.timestamp = now()
+            return transaction
+
+        for transactions in [[reward(-1000)], [signed_transaction(1), reward(1)]]:
+            block = Block.create(
+                chain.last_block.hash,
+                d.wallet.public_key,
+                chain.next_difficulty(),
+                1,
+                transactions,
+            )
+            block.proof_of_work()
+            self.assertFalse(tree.add(block))
+        self.assertEqual(chain.height, 0)
+        self.assertEqual(chain.balances.get(holder), 1000)
+
+    def test_legacy_import(self):
+        chain = Blockchain.generate()
+        for amount in range(1, 5):
+            mine_block(chain, [signed_transaction(amount)])
+        with TemporaryDirectory() as directory:
+            path = os.path.join(directory, "blockchain.json")
+            with open(path, "w") as f:
+                json.dump(chain.to_dict(), f, indent=4)
+            self.assertEqual(dict(read_blocks(path, chunk_size=16)), chain.to_dict())
+            store = BlockStore(os.path.join(directory, "blocks"))
+            validator = ChainValidator(batch_size=2)
+            blockchain, report = validator.validate_stream(read_blocks(path, 16), store)
+            self.assertTrue(report.valid)
+            self.assertEqual(len(store), 5)
+            self.assertEqual(blockchain.snapshot(), chain.snapshot())
+            with open(path, "r+") as f:
+                f.truncate(os.path.getsize(path) - 200)
+            blockchain, report = validator.validate_stream(read_blocks(path, 16), store)
+            self.assertEqual(report.error.height, 4)
+            self.assertEqual(len(store), 4)
+            store.close()
+
+    def test_baseline_migration(self):
+        with open(LEGACY_PATH) as f:
+            baseline = json.load(f)
+        holder = baseline["3"]["transactions"][1]["sender"]
+        recipient = Wallet.generate()
+        transaction = Transaction()
+        transaction.sender = d.wallet.public_key
+        transaction.recipient = recipient.public_key
+        transaction.amount = 5
+        transaction.timestamp = now()
+        # the baseline did not normalise the s value of its signatures
+        order = d.wallet.private_key.curve.order
+        r, s = sigdecode_string(
+            d.wallet.private_key.sign(transaction.to_json().encode()), order
+        )
+        transaction.signature = sigencode_string(r, max(s, order - s), order)
+        block = dict(baseline["3"], previous_hash=baseline["3"]["hash"], hash="00ff")
+        block["timestamp"] += 60
+        block["transactions"] = [transaction.to_dict(include_signature=True)]
+        baseline["4"] = block
+        # the test wallet is the one the baseline chain paid
+        self.assertEqual(d.wallet.public_key.hex(), holder)
+        with TemporaryDirectory() as directory:
+            path = os.path.join(directory, "blockchain.json")
+            with open(path, "w") as f:
+                json.dump(baseline, f)
+            store = BlockStore(os.path.join(directory, "blocks"))
+            blockchain, report = import_blocks(path, store)
+            self.assertTrue(report.valid)
+            self.assertEqual(len(store), 4)
+            self.assertEqual(blockchain.balances.get(d.wallet.public_key), 1081)
+            self.assertEqual(blockchain.balances.get(recipient.public_key), 5)
+            for height, block in enumerate(blockchain.chain):
+                self.assertEqual(block.header.height, height)
+                self.assertTrue(block.valid_proof())
+            self.assertTrue(verify_transaction(blockchain.last_block.transactions[0]))
+            reloaded = Blockchain.from_store(store)
+            self.assertEqual(reloaded.snapshot(), blockchain.snapshot())
+            # a forged signature or a broken link stops the migration
+            forged = json.loads(json.dumps(baseline))
+            forged["4"]["transactions"][0]["amount"] = 6
+            unlinked = json.loads(json.dumps(baseline))
+            unlinked["3"]["previous_hash"] = "0"
+            for data, height in ((forged, 3), (unlinked, 2)):
+                with open(path, "w") as f:
+                    json.dump(data, f)
+                store.truncate(0)
+                _, report = import_blocks(path, store)
+                self.assertEqual(report.error.height, height)
+                self.assertEqual(len(store), height)
+            store.close()
+
+    def test_legacy_import_failure(self):
+        with open(LEGACY_PATH) as f:
+            migrated = json.load(f)
+        # a genesis block without transactions cannot be migrated
+        baseline = {
+            "1": {
+                "previous_hash": "0",
+                "miner_address": "0",
+                "difficulty": 0,
+                "timestamp": 1640978587.260345,
+                "height": 0,
+                "hash": "05338cbf539402c95ae82dc7bd52371090f16079f6159ab00bd136d9dc4ec87f",
+                "nonce": None,
+                "block_size": None,
+                "transactions": [],
+            }
+        }
+        cwd = os.getcwd()
+        with TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                os.mkdir("data")
+                with open(LEGACY_PATH, "w") as f:
+                    json.dump(migrated, f)
+                daemon = Daemon(logger)
+                daemon.load()
+                self.assertEqual(len(daemon.store), 3)
+                daemon.store.close()
+            finally:
+                os.chdir(cwd)
+        with TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                os.mkdir("data")
+                with open(LEGACY_PATH, "w") as f:
+                    json.dump(baseline, f)
+                daemon = Daemon(logger)
+                with self.assertRaises(ValidationError):
+                    daemon.load()
+                self.assertTrue(os.path.isfile(LEGACY_PATH))
+                store = BlockStore()
+                self.assertEqual(len(store), 0)
+                store.close()
+            finally:
+                os.chdir(cwd)
+
     def test_tracker(self):
         self.assertTrue(d.peer.get_alive(), "Please make sure the tracker is alive")
 
@@ -0,0 +1,398 @@
+import time
+from dataclasses import dataclass, field
+from logging import RootLogger
+from statistics import median
+from typing import Iterable
+
+from block import NULL_HASH, Block, BlockHeader
+from blockchain import Blockchain
+from difficulty import MAX_BITS, MAX_FUTURE_TIME, RETARGET_WINDOW, retarget
+from merkle import merkle_root
+from store import BlockStore
+from transaction import REWARD_SENDER, TIMESTAMP_SCALE
+from verification import get_executor, verify_batch
+
+VALIDATION_BATCH = 1000
+STAGES = ("decode", "structure", "proof of work", "signatures", "state")
+
+
+class ValidationError(Exception):
+    """
+    The first block of a chain that fails validation
+
+    Attributes
+    ----------
+    height : int
+        The height of the invalid block
+    reason : str
+        Why the block is invalid
+    """
+
+    def __init__(self, height: int, reason: str) -> None:
+        super().__init__(f"Block {height} is invalid: {reason}")
+        self.height: int = height
+        self.reason: str = reason
+
+
+@dataclass
+class ValidationReport:
+    """
+    The outcome of a chain validation
+
+    Attributes
+    ----------
+    stages : dict[str, tuple[int, float]]
+        The number of items checked and the seconds spent by every stage
+    error : ValidationError
+        The first invalid block, None if the whole chain is valid
+    """
+
+    stages: dict[str, tuple[int, float]] = field(default_factory=dict)
+    error: ValidationError = None
+
+    @property
+    def valid(self) -> bool:
+        """Returns True if every block of the chain is valid."""
+        return self.error is None
+
+    def throughput(self, stage: str) -> float:
+        """Returns the number of items per second checked by a stage."""
+        items, seconds = self.stages[stage]
+        return items / seconds if seconds else float(items)
+
+    def log(self, logger: RootLogger) -> None:
+        """Logs the throughput of every stage and the first invalid block."""
+        for stage in STAGES:
+            if stage in self.stages:
+                items, seconds = self.stages[stage]
+                logger.info(
+                    f"Validation {stage}: {items} items in {seconds:.3f}s "
+                    f"({self.throughput(stage):.0f}/s)"
+                )
+        if self.error:
+            logger.error(str(self.error))
+
+
+def check_header(data: bytes, hash: bytes) -> bool:
+    """
+    Checks the hash and the proof of work of an encoded block header
+
+    Parameters
+    ----------
+    data : bytes
+        The encoded block header
+    hash : bytes
+        The hash the block claims to have
+
+    Returns
+    -------
+    bool
+        True if the header hashes to the claimed hash and meets its target
+    """
+    header = BlockHeader.from_bytes(data)
+    return header.hash == hash and Block(header, []).valid_proof()
+
+
+def body_error(block: Block) -> str:
+    """
+    Checks that the transactions of a block are the ones its header commits to
+
+    Parameters
+    ----------
+    block : Block
+        The block to check
+
+    Returns
+    -------
+    str
+        Why the transactions do not match the header, None if they do
+    """
+    txids = block.txids
+    if len(txids) == 0:
+        return "has no transactions"
+    elif len(set(txids)) != len(txids):
+        # a repeated last transaction leaves the merkle root unchanged
+        return "has a repeated transaction"
+    elif block.header.merkle_root != merkle_root(txids):
+        return "does not commit to its transactions"
+    return None
+
+
+def structure_error(
+    block: Block, height: int, previous_hash: bytes, bits: int, timestamps: list[float]
+) -> str:
+    """
+    Checks the height, link, difficulty, timestamp and transactions of a block
+
+    Parameters
+    ----------
+    block : Block
+        The block to check
+    height : int
+        The height the block is added at
+    previous_hash : bytes
+        The hash of the block it has to link to
+    bits : int
+        The compact target it has to have
+    timestamps : list[float]
+        The timestamps of the last blocks in seconds, its timestamp has to be
+        later than their median
+
+    Returns
+    -------
+    str
+        Why the block is invalid, None if it is well formed
+    """
+    header = block.header
+    timestamp = header.timestamp / TIMESTAMP_SCALE
+    if header.height != height:
+        return f"has height {header.height}"
+    elif header.previous_hash != previous_hash:
+        return "does not link to the previous block"
+    elif header.difficulty != bits:
+        return f"has difficulty {header.difficulty:x}"
+    elif timestamps and timestamp <= median(timestamps):
+        return "has a timestamp before the median of the last blocks"
+    elif timestamp > time.time() + MAX_FUTURE_TIME:
+        return "has a timestamp in the future"
+    reason = body_error(block)
+    if reason is not None:
+        return reason
+    if any(
+        index > 0 and transaction.sender == REWARD_SENDER
+        for index, transaction in enumerate(block.transactions)
+    ):
+        return "has a reward transaction that is not the first"
+    return None
+
+
+def state_error(blockchain: Blockchain, block: Block, height: int) -> str:
+    """
+    Checks the reward, spends and replays of a block against the tip of a chain
+
+    Parameters
+    ----------
+    blockchain : Blockchain
+        The blockchain the block is added to
+    block : Block
+        The block to check
+    height : int
+        The height the block is added at
+
+    Returns
+    -------
+    str
+        Why the block is invalid, None if it can be applied
+    """
+    spent = {}
+    for transaction in block.transactions:
+        if transaction.amount < 0:
+            return "has a negative amount"
+        elif transaction.txid in blockchain.transactions:
+            return "repeats a confirmed transaction"
+        elif transaction.sender == REWARD_SENDER:
+            if height > 0 and transaction.amount > blockchain.calc_reward():
+                return "rewards more than the block reward"
+            continue
+        spent[transaction.sender] = (
+            spent.get(transaction.sender, 0) + transaction.amount
+        )
+        if spent[transaction.sender] > blockchain.balances.get(transaction.sender):
+            return "spends more than the sender balance"
+    return None
+
+
+class ChainValidator:
+    """
+    Validates a chain in separate stages, the proof of work and signature stages
+    run in parallel on the process pool. The blocks go through the stages in
+    batches, so a chain can be validated as it is read.
+
+    Attributes
+    ----------
+    report : ValidationReport
+        The report of the last validation
+    batch_size : int
+        The number of blocks validated together
+    blockchain : Blockchain
+        The blockchain of the blocks validated so far
+    """
+
+    def __init__(self, batch_size: int = VALIDATION_BATCH) -> None:
+        self.batch_size: int = batch_size
+        self.reset()
+
+    def reset(self, store: BlockStore = None) -> None:
+        """Starts a new validation, the valid blocks are written to the store."""
+        self.report = ValidationReport()
+        self.blockchain = Blockchain()
+        if store is not None:
+            self.blockchain.attach(store)
+        self.previous_hash = NULL_HASH
+        self.bits = MAX_BITS
+        self.timestamps = []
+
+    def fail(self, height: int, reason: str) -> None:
+        """Records the invalid block if it is the first one found so far."""
+        if self.report.error is None or height < self.report.error.height:
+            self.report.error = ValidationError(height, reason)
+
+    def record(self, stage: str, items: int, started: float) -> None:
+        """Adds the number of items and the time spent by a stage to the report."""
+        total, seconds = self.report.stages.get(stage, (0, 0.0))
+        self.report.stages[stage] = (
+            total + items,
+            seconds + time.perf_counter() - started,
+        )
+
+    def validate(
+        self, json_data: dict, store: BlockStore = None
+    ) -> tuple[Blockchain, ValidationReport]:
+        """
+        Validates a chain and builds a blockchain from its longest valid prefix
+
+        Parameters
+        ----------
+        json_data : dict
+            The chain as stored in blockchain.json
+        store : BlockStore
+            An empty store the valid blocks are written to, None to keep them in memory
+
+        Returns
+        -------
+        tuple[Blockchain, ValidationReport]
+            The blockchain of the valid blocks, None if the genesis block is invalid,
+            and the validation report
+        """
+        return self.validate_stream(json_data.items(), store)
+
+    def validate_stream(
+        self, items: Iterable[tuple[str, dict]], store: BlockStore = None
+    ) -> tuple[Blockchain, ValidationReport]:
+        """
+        Validates a chain batch by batch as its blocks are read
+
+        Parameters
+        ----------
+        items : Iterable[tuple[str, dict]]
+            The key and json dict of every block, in chain order
+        store : BlockStore
+            An empty store the valid blocks are written to, None to keep them in memory
+
+        Returns
+        -------
+        tuple[Blockchain, ValidationReport]
+            The blockchain of the valid blocks, None if the genesis block is invalid,
+            and the validation report
+        """
+        self.reset(store)
+        batch = []
+        try:
+            for item in items:
+                batch.append(item)
+                if len(batch) == self.batch_size:
+                    valid = self.validate_batch(batch)
+                    batch = []
+                    if not valid:
+                        break
+        except ValueError as e:
+            height = self.blockchain.height + len(batch) + 1
+            self.fail(height, f"could not be read ({e!r})")
+        if batch:
+            self.validate_batch(batch)
+        if len(self.blockchain.chain) == 0:
+            return None, self.report
+        return self.blockchain, self.report
+
+    def validate_batch(self, items: list[tuple[str, dict]]) -> bool:
+        """
+        Runs a batch of blocks through every stage and applies the valid ones
+
+        Parameters
+        ----------
+        items : list[tuple[str, dict]]
+            The key and json dict of every block of the batch
+
+        Returns
+        -------
+        bool
+            True if every block of the batch is valid
+        """
+        start = self.blockchain.height + 1
+        blocks = self.decode(items, start)
+        self.check_structure(blocks, start)
+        started = time.perf_counter()
+        # the headers are checked on the pool while the signatures are verified
+        headers = get_executor().map(
+            check_header,
+            [bytes(block.header) for block in blocks],
+            [block.hash for block in blocks],
+            chunksize=max(1, len(blocks) // 64),
+        )
+        self.check_signatures(blocks, start)
+        for height, valid in enumerate(headers, start=start):
+            if not valid:
+                self.fail(height, "hash does not meet the proof of work")
+        self.record("proof of work", len(blocks), started)
+        self.apply(blocks, start)
+        return self.report.error is None
+
+    def decode(self, items: list[tuple[str, dict]], start: int) -> list[Block]:
+        """Stage 1, decodes the blocks in chain order."""
+        started = time.perf_counter()
+        blocks = []
+        for height, (key, block) in enumerate(items, start=start):
+            if key != str(height):
+                self.fail(height, f"stored under key {key}")
+                break
+            try:
+                blocks.append(Block.from_json(block))
+            except (KeyError, TypeError, ValueError) as e:
+                self.fail(height, f"could not be decoded ({e!r})")
+                break
+        self.record("decode", len(blocks), started)
+        return blocks
+
+    def check_structure(self, blocks: list[Block], start: int) -> None:
+        """Stage 2, checks the header fields and the merkle root of every block."""
+        started = time.perf_counter()
+        for height, block in enumerate(blocks, start=start):
+            header = block.header
+            reason = structure_error(
+                block, height, self.previous_hash, self.bits, self.timestamps
+            )
+            if reason is not None:
+                self.fail(height, reason)
+            self.previous_hash = header.hash
+            self.timestamps.append(header.timestamp / TIMESTAMP_SCALE)
+            self.timestamps = self.timestamps[-RETARGET_WINDOW:]
+            self.bits = retarget(self.timestamps, header.difficulty, height + 1)
+        self.record("structure", len(blocks), started)
+
+    def check_signatures(self, blocks: list[Block], start: int) -> None:
+        """Stage 4, verifies every signature of the blocks in one batch."""
+        started = time.perf_counter()
+        transactions = []
+        heights = []
+        for height, block in enumerate(blocks, start=start):
+            for transaction in block.transactions:
+                transactions.append(transaction)
+                heights.append(height)
+        for height, valid in zip(heights, verify_batch(transactions)):
+            if not valid:
+                self.fail(height, "has an invalid signature")
+        self.record("signatures", len(transactions), started)
+
+    def apply(self, blocks: list[Block], start: int) -> None:
+        """Stage 5, applies the valid blocks in order and checks every balance."""
+        started = time.perf_counter()
+        if self.report.error is not None:
+            blocks = blocks[: self.report.error.height - start]
+        blockchain = self.blockchain
+        for height, block in enumerate(blocks, start=start):
+            reason = state_error(blockchain, block, height)
+            if reason is not None:
+                self.fail(height, reason)
+                break
+            blockchain.add_block(block)
+        self.record("state", blockchain.height - start + 1, started)
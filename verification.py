@@ -0,0 +1,116 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable
+
+from ecdsa import BadSignatureError
+from ecdsa.errors import MalformedPointError
+from ecdsa.util import MalformedSignature
+
+from transaction import REWARD_SENDER, Transaction, public_keys
+
+MIN_PARALLEL_BATCH = 64
+
+executor: ProcessPoolExecutor = None
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """Returns the process pool shared by every batch, creating it on first use."""
+    global executor
+    if executor is None:
+        executor = ProcessPoolExecutor(max_workers=os.cpu_count() or 1)
+    return executor
+
+
+def verify_transaction(transaction: Transaction) -> bool:
+    """
+    Verifies the signature of a transaction
+
+    Reward transactions are sent by REWARD_SENDER and carry no signature, they are accepted here
+    and their amount is checked when the block is applied.
+
+    Parameters
+    ----------
+    transaction : Transaction
+        The transaction to verify
+
+    Returns
+    -------
+    bool
+        True if the signature is valid, False otherwise
+    """
+    if transaction.sender == REWARD_SENDER:
+        return True
+    try:
+        return transaction.verify()
+    except (
+        BadSignatureError,
+        MalformedPointError,
+        MalformedSignature,
+        ValueError,
+        TypeError,
+        AttributeError,
+    ):
+        return False
+
+
+def verify_counted(transaction: Transaction) -> tuple[bool, int, int]:
+    """
+    Verifies a transaction in a worker process
+
+    Parameters
+    ----------
+    transaction : Transaction
+        The transaction to verify
+
+    Returns
+    -------
+    tuple[bool, int, int]
+        The result, and the key cache hits and misses of the verification
+    """
+    hits, misses = public_keys.hits, public_keys.misses
+    valid = verify_transaction(transaction)
+    return valid, public_keys.hits - hits, public_keys.misses - misses
+
+
+def verify_batch(
+    transactions: Iterable[Transaction], min_batch: int = MIN_PARALLEL_BATCH
+) -> list[bool]:
+    """
+    Verifies the signatures of a batch of transactions across the process pool
+
+    Transactions found in the signature cache are not sent to the pool.
+
+    Parameters
+    ----------
+    transactions : Iterable[Transaction]
+        The transactions of a block or a slice of the ether
+    min_batch : int
+        Batches smaller than this are verified on the calling thread
+
+    Returns
+    -------
+    list[bool]
+        The result of every transaction, in order
+    """
+    transactions = list(transactions)
+    results = [transaction.verified for transaction in transactions]
+    pending = [transaction for transaction, ok in zip(transactions, results) if not ok]
+    if len(pending) < min_batch:
+        checked = [verify_transaction(transaction) for transaction in pending]
+    else:
+        chunksize = max(1, len(pending) // ((os.cpu_count() or 1) * 4))
+        checked = []
+        for valid, hits, misses in get_executor().map(
+            verify_counted, pending, chunksize=chunksize
+        ):
+            # the workers parse the keys with their own caches
+            public_keys.count_worker(hits, misses)
+            checked.append(valid)
+    checked = iter(checked)
+    for i, transaction in enumerate(transactions):
+        if not results[i]:
+            results[i] = next(checked)
+            if results[i] and transaction.sender != REWARD_SENDER:
+                # the worker process filled its own cache, remember it here too
+                transaction.mark_verified()
+    return results
@@ -9,13 +9,13 @@ class Wallet:
     ----------
     private_key : SigningKey
         The private key of the wallet
-    public_key : str
-        The public key of the wallet
+    public_key : bytes
+        The raw public key of the wallet, its address
     """
 
     def __init__(self):
         self.private_key: SigningKey = None
-        self.public_key: str = None
+        self.public_key: bytes = None
 
     @classmethod
     def from_private_key(cls, private_key: bytes) -> "Wallet":
@@ -34,7 +34,7 @@ class Wallet:
         """
         wallet = cls()
         wallet.private_key = SigningKey.from_pem(private_key)
-        wallet.public_key = wallet.private_key.verifying_key.to_string().hex()
+        wallet.public_key = wallet.private_key.verifying_key.to_string()
         return wallet
 
     @classmethod
@@ -49,5 +49,5 @@ class Wallet:
         """
         wallet = cls()
         wallet.private_key = SigningKey.generate()
-        wallet.public_key = wallet.private_key.verifying_key.to_string().hex()
+        wallet.public_key = wallet.private_key.verifying_key.to_string()
         return wallet
@@ -119,16 +119,66 @@ function minefunc(bool) {
 let minestart = document.getElementById("start_mining");
 let minestop = document.getElementById("stop_mining");
 
+let hashrate_history = [];
+let stats_timer = null;
+
 eel.expose(enable_mining_button, "enable_mining_button");
 
 function enable_mining_button(bool) {
 	if (bool) {
 		minestart.classList.add("disabled");
 		minestop.classList.remove("disabled");
+		stats_timer = setInterval(update_mining_stats, 2000);
 	} else {
 		minestart.classList.remove("disabled");
 		minestop.classList.add("disabled");
+		clearInterval(stats_timer);
+		update_mining_stats();
+	}
+}
+
+function update_mining_stats() {
+	eel.get_mining_stats()(function (data) {
+		document.getElementById("stat-hashrate").innerHTML = Math.round(
+			data.hashrate
+		);
+		document.getElementById("stat-difficulty").innerHTML = data.difficulty;
+		document.getElementById("stat-workers").innerHTML = data.workers;
+		document.getElementById("stat-attempts").innerHTML = data.attempts;
+		document.getElementById("stat-block-time").innerHTML =
+			data.last_block_time === null ? "-" : data.last_block_time.toFixed(2);
+		document.getElementById("stat-last-attempts").innerHTML =
+			data.last_attempts;
+		document.getElementById("stat-mined").innerHTML = data.blocks_mined;
+		document.getElementById("stat-aborted").innerHTML = data.blocks_aborted;
+		document.getElementById("stat-stale").innerHTML = data.stale_attempts;
+		document.getElementById("stat-worker-hashrates").innerHTML =
+			data.hashrates.map(Math.round).join(", ") || "-";
+		hashrate_history.push(data.hashrate);
+		if (hashrate_history.length > 60) {
+			hashrate_history.shift();
+		}
+		draw_hashrate_chart();
+	});
+}
+
+function draw_hashrate_chart() {
+	let canvas = document.getElementById("hashrate-chart");
+	let ctx = canvas.getContext("2d");
+	let max = Math.max(...hashrate_history, 1);
+	let step = canvas.width / 59;
+	ctx.clearRect(0, 0, canvas.width, canvas.height);
+	ctx.strokeStyle = "#198754";
+	ctx.beginPath();
+	for (let i = 0; i < hashrate_history.length; i++) {
+		let y = canvas.height - (hashrate_history[i] / max) * canvas.height;
+		if (i === 0) {
+			ctx.moveTo(0, y);
+		} else {
+			ctx.lineTo(i * step, y);
+		}
 	}
+	ctx.stroke();
 }
 
 eel.get_balance();